@@ -5,11 +5,15 @@
 """
 
 import argparse
+import os
 import sys
 
 import phantom_wrapper as phw
 import utils as ut
 
+## Output formats that can be selected: t - txt, m - mat, p - png
+OUTPUT_FORMATS = frozenset("tmp")
+
 
 def get_example_text():
     """!
@@ -70,14 +74,26 @@ def parse_arguments():
     required_named.add_argument('-o', '--output_name', help="Name of the output files (txt, mat and png). If a directory is used as input, this will be the subdirectory name", required=True)
     optional_args = parser.add_argument_group('Optional arguments')
     optional_args.add_argument('-v', '--verbosity', help="Enables verbose output. Values: 'on' and 'off' (without quotes)", required=False)
+    optional_args.add_argument('-j', '--jobs', help="Number of processes used to generate the slices of 3-D phantoms or the phantoms of a directory of images. Default: number of CPUs", type=int, default=os.cpu_count() or 1, required=False)
 
     args = parser.parse_args()
 
-    if 't' not in args.format and 'm' not in args.format and 'p' not in args.format:
+    formats = set(args.format)
+    invalid_formats = formats - OUTPUT_FORMATS
+
+    if not (formats & OUTPUT_FORMATS):
         print("Unsupported output format defined.\r\n")
         parser.print_help()
         sys.exit(0)
 
+    if args.jobs < 1:
+        print("Number of jobs should be >= 1.\r\n")
+        parser.print_help()
+        sys.exit(0)
+
+    if invalid_formats:
+        print("Unsupported output formats ignored: " + " ".join(sorted(invalid_formats)) + "\r\n")
+
     return args
 
 
@@ -86,7 +102,7 @@ def main():
     \brief Has the sequence of actions to generate the phantom
     """
 
-    ut.log_message("Starting application")
+    ut.log("Starting application")
 
     args = parse_arguments()
 
@@ -94,7 +110,7 @@ def main():
     phantom.gen_phantom()
     phantom.show_phantom()
 
-    ut.log_message("End of execution")
+    ut.log("End of execution")
 
 
 if __name__ == "__main__":
@@ -4,189 +4,356 @@
 \brief Validate that the required parameters are present in the configuration file
 """
 
+import functools
+import json
 import warnings
 from . import structures as struc
 from pathlib import Path
 
+import jsonschema
 
-def check_parameters_are_present(configuration, is_image):
+try:
+    import fastjsonschema
+except ImportError:
+    # Optional, only jsonschema is used if fastjsonschema is not installed
+    fastjsonschema = None
+
+## Path of the json schema describing a valid configuration
+SCHEMA_PATH = Path(__file__).with_name("phantom_schema.json")
+
+with open(SCHEMA_PATH) as schema_file:
+    ## Json schema describing a valid configuration
+    _SCHEMA = json.load(schema_file)
+
+## Validator built once from the schema and reused for every configuration
+_VALIDATOR = jsonschema.Draft202012Validator(_SCHEMA)
+
+## Names (singular and plural) used in the messages of parameters restricted to a set of values
+_ENUM_NAMES = {
+    "distribution": ("distribution", "distributions"),
+    "phantom_format": ("format", "formats"),
+    "type": ("structure of type", "structures")
+}
+
+## Parameters that must be valid before checking if the structures fit in the phantom
+_SIZE_PARAMETERS = {"rows_y", "cols_x", "depth_z", "structures"}
+
+
+def lower_case_values(configuration):
     """!
-    \brief Checks if global parameters are present
+    \brief Creates a copy of the configuration with the case-insensitive values in lower case
 
     \param configuration Parsed configuration
-    \param is_image Set to True if the input for phantom generation is an image file
 
-    \note Raises an exception if there is any error
+    \return A shallow copy of the configuration with distribution, phantom format and structures types in lower case
     """
 
-    error_msg = ""
+    config = dict(configuration)
+
+    for parameter in ["distribution", "phantom_format"]:
+        if isinstance(config.get(parameter), str):
+            config[parameter] = config[parameter].lower()
+
+    if isinstance(config.get("structures"), list):
+        structures = []
+        for region in config["structures"]:
+            if isinstance(region, dict) and isinstance(region.get("type"), str):
+                region = dict(region, type=region["type"].lower())
+            structures.append(region)
 
-    if not is_image:
-        # Get size information from input image
-        if "rows_y" not in configuration:
-            error_msg = error_msg + "Parameter \"rows_y\" is missing.\r\n"
+        config["structures"] = structures
 
-        if "cols_x" not in configuration:
-            error_msg = error_msg + "Parameter \"cols_x\" is missing.\r\n"
+    return config
 
-    if "distribution" not in configuration:
-        error_msg = error_msg + "Parameter \"distribution\" is missing.\r\n"
 
-    if "perc_of_scatterers" not in configuration:
-        error_msg = error_msg + "Parameter \"perc_of_scatterers\" is missing.\r\n"
+def structure_name(configuration, path):
+    """!
+    \brief Gets the name used in error messages for the structure where an error was found
+
+    \param configuration Parsed configuration
+    \param path Path of the schema error, starting with "structures" and the structure index
+
+    \return The structure type or its position if no type is defined
+    """
+
+    region = configuration["structures"][path[1]]
+
+    if isinstance(region, dict) and "type" in region:
+        return str(region["type"])
+
+    return str(path[1])
+
+
+def format_schema_error(configuration, error):
+    """!
+    \brief Converts an error found by the schema validator in an error message
+
+    \param configuration Parsed configuration
+    \param error The jsonschema.ValidationError to be converted
+
+    \return The error message
+    """
 
-    if "phantom_format" not in configuration:
-        error_msg = error_msg + "Parameter \"phantom_format\" is missing.\r\n"
+    parameter = error.path[-1] if error.path else ""
+    in_structure = len(error.path) > 1 and error.path[0] == "structures"
+
+    if error.validator == "enum" and parameter in _ENUM_NAMES:
+        name, plural = _ENUM_NAMES[parameter]
+        error_msg = "".join(["The ", name, " ", str(error.instance), " is not supported.\r\n",
+                             "Supported ", plural, " are: ", " ".join(error.validator_value), ".\r\n"])
+    elif error.validator == "additionalProperties":
+        # Unknown parameters are reported by the object that contains them
+        if error.path:
+            error_msg = "Structure " + structure_name(configuration, error.path) + ": " + error.message + "\r\n"
+        else:
+            error_msg = error.message + "\r\n"
+    elif parameter == "perc_of_scatterers":
+        error_msg = "Percentage of scatterers should be > 0 and < 100 %\r\n"
+    elif in_structure and parameter == "scat_gain":
+        error_msg = "Structure " + structure_name(configuration, error.path) + ": relative amplitude of the scatterers should be >= 0\r\n"
+    elif in_structure:
+        location = "/".join(str(node) for node in list(error.path)[2:])
+        error_msg = "Structure " + structure_name(configuration, error.path) + ": parameter \"" + location + "\": " + error.message + "\r\n"
     else:
-        if configuration["phantom_format"] == "k_wave":
-            if "sound_speed_c0_m_per_s" not in configuration:
-                error_msg = error_msg + "Parameter \"sound_speed_c0_m_per_s\" is missing.\r\n"
-            if "density_rho0_kg_per_m3" not in configuration:
-                error_msg = error_msg + "Parameter \"density_rho0_kg_per_m3\" is missing.\r\n"
+        location = "/".join(str(node) for node in error.path)
+        error_msg = "Parameter \"" + location + "\": " + error.message + "\r\n"
 
-    if error_msg:
-        raise Exception("One of more parameters is missing in the configuration file.\r\n" + error_msg)
+    return error_msg
 
 
-def validate_distribution(distribution):
+@functools.lru_cache(maxsize=None)
+def _fast_validators():
     """!
-    \brief Checks if a valid statiscal distribution was specified
+    \brief Compiles (with fastjsonschema) the validators of the phantom parameters and of each type of structure
+
+    \note The validators are compiled on the first call only, so importing this module stays fast
+
+    \return The validator of the phantom parameters and a dictionary with the validator of each type of structure
+    """
+
+    # In the schema of the phantom parameters the structures are only checked for their type and gain. The parameters of
+    # each structure are checked by the validator of its type, so the compiled code does not try the subschemas of all types
+    structure_schema = {key: value for key, value in _SCHEMA["$defs"]["structure"].items() if key != "allOf"}
+    phantom_schema = dict(_SCHEMA, **{"$defs": dict(_SCHEMA["$defs"], structure=structure_schema)})
+
+    structure_validators = {
+        structure_type: fastjsonschema.compile(dict(_SCHEMA["$defs"][structure_type], **{"$defs": _SCHEMA["$defs"]}),
+                                               use_default=False)
+        for structure_type in structure_schema["properties"]["type"]["enum"]
+    }
 
-    \param distribution String containing the desired statistical distribution
+    return fastjsonschema.compile(phantom_schema, use_default=False), structure_validators
+
+
+def is_valid_schema(configuration):
+    """!
+    \brief Checks quickly, with the compiled validators, if a configuration matches the schema
+
+    \param configuration Parsed configuration (with case-insensitive values in lower case)
+
+    \note Always returns False if fastjsonschema is not installed, so the configuration is checked with jsonschema only
+
+    \return True if the configuration matches the schema; False otherwise
+    """
+
+    if fastjsonschema is None:
+        return False
+
+    phantom_validator, structure_validators = _fast_validators()
+
+    try:
+        phantom_validator(configuration)
+
+        # The type of the structures was checked, so each structure is checked by the validator of its type
+        for region in configuration.get("structures", []):
+            structure_validators[region["type"]](region)
+    except fastjsonschema.JsonSchemaException:
+        return False
+
+    return True
+
+
+def validate_schema(configuration, schema_errors):
+    """!
+    \brief Converts the errors found by the schema validator in an error string
+
+    \param configuration Parsed configuration (with case-insensitive values in lower case)
+    \param schema_errors The errors found when validating the configuration against the schema
+
+    \note Raises an exception if a global parameter is missing
 
     \return An empty string if no error is found; an error string otherwise
     """
 
-    error_msg = ""
+    errors = []
+    missing = []
+    reported = set()
 
-    supported_distributions = ["uniform", "gaussian", "rayleigh"]
+    for error in schema_errors:
+        if error.validator != "required":
+            errors.append(format_schema_error(configuration, error))
+            continue
 
-    if distribution not in supported_distributions:
-        error_msg = 'The distribution ' + distribution + " is not supported.\r\n"
-        error_msg = error_msg + "Supported distributions are:"
-        for dist in supported_distributions:
-            error_msg = error_msg + " " + dist
+        # One error is raised per missing parameter, but all of them refer to the complete list
+        for parameter in error.validator_value:
+            if parameter in error.instance or (tuple(error.path), parameter) in reported:
+                continue
 
-        error_msg = error_msg + ".\r\n"
+            reported.add((tuple(error.path), parameter))
+            if not error.path:
+                missing.append("Parameter \"" + parameter + "\" is missing.\r\n")
+            else:
+                errors.append("Structure " + structure_name(configuration, error.path) + ": parameter \"" + parameter + "\" is missing.\r\n")
 
-    return error_msg
+    if missing:
+        raise Exception("One of more parameters is missing in the configuration file.\r\n" + "".join(missing))
 
+    return "".join(errors)
 
-def validate_perc_of_scat(perc_of_scatterers):
+
+def _validate_circles(regions, num_of_rows, num_of_cols, num_of_z):
     """!
-    \brief Checks if percentage of scatterers points in the matrix is valid
+    \brief Checks if the circles are within boundaries
 
-    \param perc_of_scatterers Percentage of area that will be filled with scaterrers [0%, 100%]
+    \param regions The circles present in the configuration file
+    \param num_of_rows Number of rows of the phantom
+    \param num_of_cols Number of collumns of the phantom
+    \param num_of_z Number of slices of the phantom (unused)
 
     \return An empty string if no error is found; an error string otherwise
     """
 
-    error_msg = ""
+    return struc.Circle.validate_batch([region["center_xy"] for region in regions], [region["radius"] for region in regions],
+                                       num_of_rows, num_of_cols)
 
-    if perc_of_scatterers <= 0 or perc_of_scatterers > 100:
-        error_msg = error_msg + "Percentage of scatterers should be > 0 and < 100 %\r\n"
-    elif perc_of_scatterers == 100:
-        warnings.warn_explicit("Percentage of scatterers is set to 100 %. Please check your configuration.\r\n", UserWarning, "", 0)
 
-    return error_msg
+def _validate_ellipses(regions, num_of_rows, num_of_cols, num_of_z):
+    """!
+    \brief Checks if the ellipses are within boundaries
+
+    \param regions The ellipses present in the configuration file
+    \param num_of_rows Number of rows of the phantom
+    \param num_of_cols Number of collumns of the phantom
+    \param num_of_z Number of slices of the phantom (unused)
+
+    \return An empty string if no error is found; an error string otherwise
+    """
+
+    errors = []
 
+    # The extent of an ellipse depends on its rotation, so they are validated one by one
+    for region in regions:
+        ell = struc.Ellipse([struc.Point(region["center_xy"])], region["semi_axis_x"], region["semi_axis_y"], region["rotation_angle_deg"])
+        errors.append(ell.validate(num_of_rows, num_of_cols))
 
-def validate_scat_gain(structure_type, scat_gain):
+    return "".join(errors)
+
+
+def _validate_rectangles(regions, num_of_rows, num_of_cols, num_of_z):
     """!
-    \brief Checks if the relative amplitude of the scatterers of a region is valid
+    \brief Checks if the rectangles are within boundaries
 
-    \param structure_type The structure for which the gain is being validated
-    \param scat_gain The gain of the scatterers inside the structure
+    \param regions The rectangles present in the configuration file
+    \param num_of_rows Number of rows of the phantom
+    \param num_of_cols Number of collumns of the phantom
+    \param num_of_z Number of slices of the phantom (unused)
 
     \return An empty string if no error is found; an error string otherwise
     """
 
-    error_msg = ""
+    return struc.Rectangle.validate_batch([region["top_left_corner_xy"] for region in regions],
+                                          [(region["length_x"], region["length_y"]) for region in regions],
+                                          num_of_rows, num_of_cols)
 
-    if scat_gain < 0:
-        error_msg = error_msg + "Structure " + structure_type + ": relative amplitude of the scatterers should be >= 0\r\n"
 
-    return error_msg
+def _validate_free_polygons(regions, num_of_rows, num_of_cols, num_of_z):
+    """!
+    \brief Checks if the vertices of the polygons are within boundaries
+
+    \param regions The polygons present in the configuration file
+    \param num_of_rows Number of rows of the phantom
+    \param num_of_cols Number of collumns of the phantom
+    \param num_of_z Number of slices of the phantom (unused)
+
+    \return An empty string if no error is found; an error string otherwise
+    """
 
+    return struc.Polygon.validate_batch([vertex for region in regions for vertex in region["vertices_xy"]],
+                                        [len(region["vertices_xy"]) for region in regions], num_of_rows, num_of_cols)
 
-def validate_phantom_format(phantom_format):
+
+def _validate_points(regions, num_of_rows, num_of_cols, num_of_z):
     """!
-    \brief Checks if the phantom compatibility format is valid
+    \brief Checks if the single points are within boundaries
 
-    \param phantom_format The string with the phantom format (compatible toolbox)
+    \param regions The sets of points present in the configuration file
+    \param num_of_rows Number of rows of the phantom
+    \param num_of_cols Number of collumns of the phantom
+    \param num_of_z Number of slices of the phantom (unused)
 
     \return An empty string if no error is found; an error string otherwise
     """
 
-    error_msg = ""
+    return struc.SinglePoint.validate_batch([point for region in regions for point in region["coordinates_xy"]],
+                                            [len(region["coordinates_xy"]) for region in regions], num_of_rows, num_of_cols)
 
-    supported_formats = ["effec_scatterers", "k_wave"]
 
-    if phantom_format not in supported_formats:
-        error_msg = 'The format ' + phantom_format + " is not supported.\r\n"
-        error_msg = error_msg + "Supported formats are:"
-        for dist in supported_formats:
-            error_msg = error_msg + " " + dist
+def _validate_spheres(regions, num_of_rows, num_of_cols, num_of_z):
+    """!
+    \brief Checks if the spheres are within boundaries
 
-        error_msg = error_msg + ".\r\n"
+    \param regions The spheres present in the configuration file
+    \param num_of_rows Number of rows of the phantom
+    \param num_of_cols Number of collumns of the phantom
+    \param num_of_z Number of slices of the phantom
 
-    return error_msg
+    \return An empty string if no error is found; an error string otherwise
+    """
+
+    return struc.Sphere.validate_batch([region["center_xyz"] for region in regions], [region["radius"] for region in regions],
+                                       num_of_rows, num_of_cols, num_of_z)
+
+
+## Function used to validate all structures of each supported type
+_VALIDATORS = {
+    "circle": _validate_circles,
+    "ellipse": _validate_ellipses,
+    "rectangle": _validate_rectangles,
+    "free_polygon": _validate_free_polygons,
+    "points": _validate_points,
+    "sphere": _validate_spheres
+}
+
+## Types of structures that can be added to a phantom
+SUPPORTED_STRUCTURES = frozenset(_VALIDATORS)
 
 
 def validate_structures(structures, num_of_rows, num_of_cols, num_of_z):
     """!
-    \brief Checks if the structures are valid (are within boundaries and
-    contain all parameters)
+    \brief Checks if the structures are valid (are within boundaries)
 
     \param structures All the structures present in the configuration file
     \param num_of_rows Number of rows of the phantom
     \param num_of_cols Number of collumns of the phantom
     \param num_of_z Number of slices of the phantom (3-D phantoms)
 
+    \note The structures must have been checked against the schema
+
     \return An empty string if no error is found; an error string otherwise
     """
 
-    error_msg = ""
-
-    supported_structures = ["circle", "ellipse", "rectangle", "free_polygon", "points", "sphere"]
+    errors = []
 
+    # Group the structures by type, so all structures of a type are validated at once
+    regions = {region_type: [] for region_type in SUPPORTED_STRUCTURES}
     for region in structures:
-        region_type = region["type"].lower()
-        if region_type not in supported_structures:
-            error_msg = 'The structure of type ' + region_type + " is not supported.\r\n"
-            error_msg = error_msg + "Supported structures are:"
-            for structure in supported_structures:
-                error_msg = error_msg + " " + structure
-        else:
-            error_msg = error_msg + validate_scat_gain(region["type"], region["scat_gain"])
-            if region_type == "circle":
-                circ = struc.Circle([struc.Point(region["center_xy"])], region["radius"])
-                error_msg = error_msg + circ.validate(num_of_rows, num_of_cols)
-            elif region_type == "ellipse":
-                ell = struc.Ellipse([struc.Point(region["center_xy"])], region["semi_axis_x"], region["semi_axis_y"], region["rotation_angle_deg"])
-                error_msg = error_msg + ell.validate(num_of_rows, num_of_cols)
-            elif region_type == "rectangle":
-                rec = struc.Rectangle([struc.Point((region["top_left_corner_xy"]))], region["length_x"], region["length_y"])
-                error_msg = error_msg + rec.validate(num_of_rows, num_of_cols)
-            elif region_type == "free_polygon":
-                polygon = []
-                for point in range(len(region["vertices_xy"])):
-                    polygon.append(struc.Point(region["vertices_xy"][point]))
-
-                poly = struc.Polygon(polygon)
-                error_msg = error_msg + poly.validate(num_of_rows, num_of_cols)
-            elif region_type == "points":
-                points = []
-                for point in range(len(region["coordinates_xy"])):
-                    points.append(struc.Point(region["coordinates_xy"][point]))
-
-                s_points = struc.SinglePoint(points)
-                error_msg = error_msg + s_points.validate(num_of_rows, num_of_cols)
-            elif region_type == "sphere":
-                sp = struc.Sphere([struc.Point(region["center_xyz"])], region["radius"])
-                error_msg = error_msg + sp.validate(num_of_rows, num_of_cols, num_of_z)
+        regions[region["type"].lower()].append(region)
 
-    return error_msg
+    for region_type, validator in _VALIDATORS.items():
+        if regions[region_type]:
+            errors.append(validator(regions[region_type], num_of_rows, num_of_cols, num_of_z))
+
+    return "".join(errors)
 
 
 def validate_configuration(configuration):
@@ -200,43 +367,45 @@ def validate_configuration(configuration):
     \return An empty string if no error is found; an error string otherwise
     """
 
-    error_msg = ""
+    errors = []
 
     image_path = configuration.get("image_path", "")
 
-    if image_path == "":
-        check_parameters_are_present(configuration, False)
-    else:
-        check_parameters_are_present(configuration, True)
+    config = lower_case_values(configuration)
 
-    # Statiscal distributions used to generate the scatterers
-    error_msg = error_msg + validate_distribution(configuration["distribution"].lower())
+    # Presence, types and supported values of the parameters. The compiled validators (fastjsonschema) accept valid
+    # configurations quickly, but their errors are not detailed. jsonschema finds all the errors, to build the messages,
+    # so it is only used if the configuration is invalid (or if fastjsonschema is not installed)
+    if is_valid_schema(config):
+        schema_errors = []
+    else:
+        schema_errors = list(_VALIDATOR.iter_errors(config))
+    errors.append(validate_schema(config, schema_errors))
 
     # Percentage of scatterers (non-zero elements) in the final matrix
-    perc_of_scatterers = configuration["perc_of_scatterers"]
-    error_msg = error_msg + validate_perc_of_scat(perc_of_scatterers)
+    if config["perc_of_scatterers"] == 100:
+        warnings.warn_explicit("Percentage of scatterers is set to 100 %. Please check your configuration.\r\n", UserWarning, "", 0)
 
-    # Phantom format
-    phantom_format = configuration["phantom_format"].lower()
-    error_msg = error_msg + validate_phantom_format(phantom_format)
+    phantom_format = config["phantom_format"]
+
+    # Checks that depend on other parameters can only be done if these parameters are valid
+    invalid_parameters = {error.path[0] for error in schema_errors if error.path}
 
     if image_path == "":
-        # Matrix size
-        rows = configuration["rows_y"]
-        cols = configuration["cols_x"]
-        num_of_z = configuration.get("depth_z", 1)
-        if (num_of_z > 1) and (phantom_format == "effec_scatterers"):
-            error_msg = error_msg + "effec_scatterers only supports 2-D phantoms\r\n"
-
-        # Check if the structures defined are valid
-        error_msg = error_msg + validate_structures(configuration["structures"], rows, cols, num_of_z)
-    else:
+        num_of_z = config.get("depth_z", 1)
+        if ("depth_z" not in invalid_parameters) and (num_of_z > 1) and (phantom_format == "effec_scatterers"):
+            errors.append("effec_scatterers only supports 2-D phantoms\r\n")
+
+        # Check if the structures defined fit in the phantom
+        if invalid_parameters.isdisjoint(_SIZE_PARAMETERS):
+            errors.append(validate_structures(config["structures"], config["rows_y"], config["cols_x"], num_of_z))
+    elif "image_path" not in invalid_parameters:
         input_image = Path(image_path)
 
         if not input_image.is_file() and not input_image.is_dir():
             raise Exception("Input image \"" + image_path + "\" was not found.")
 
         if (phantom_format != "effec_scatterers"):
-            error_msg = error_msg + "Using image as input is supported only with effec_scatterers format\r\n"
+            errors.append("Using image as input is supported only with effec_scatterers format\r\n")
 
-    return error_msg
+    return "".join(errors)
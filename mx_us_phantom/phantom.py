@@ -4,50 +4,48 @@
 \brief Methods to do the generation of the phantom
 """
 
-from operator import mod
+from concurrent.futures import ProcessPoolExecutor
 import os
 import numpy as np
-import matplotlib.pyplot
+import matplotlib.image
 import math
 import scipy.io
+import zlib
 from . import structures as struc
 import utils as ut
 from PIL import Image
 import pydicom as dicom
 
+## Type of the arrays that store the scatterers amplitude (single precision is enough for the amplitudes)
+CMPLX = np.complex64
+
 
 class Phantom():
     """!
-    \brief The 2-D phantom. 3-D phantoms are built with one 2-D phantom per slice
+    \brief The phantom. 3-D phantoms are generated slice by slice, reusing the same structures
     """
 
-    def generate_phantom_from_image(self, config, input_image):
+    def __init__(self, config):
         """!
-        \brief Generates the scatterers of a phantom created from an image
+        \brief Reads the phantom parameters and creates its structures
 
         \param config The parsed configuration
-        \param input_image The image file used as reference to generate the phantom
+
+        \note Raises an exception if no known structure is specified
         """
 
+        ## The parsed configuration
+        self.config = config
+
+        ## Set to True if the message should be logged
+        self.verbose = config.get("verbose", False)
+
         ## Statistical distribution of the scatterers in the phantom
         self.dist = config["distribution"].lower()
 
         ## Percentage of scatterers in the phantom
         self.dens = config["perc_of_scatterers"]
 
-        ## 2-D array that will store the scatterers amplitude
-        if input_image.lower().endswith('.dcm'):
-            self.phantom = dicom.dcmread(input_image).pixel_array
-            self.phantom = np.transpose(self.phantom.astype(complex))
-        else:
-            self.phantom = np.transpose(np.array(Image.open(input_image).convert('L'), dtype=np.complex_))
-
-        ## Number of rows in the phantom
-        self.num_of_rows = self.phantom.shape[1]
-
-        ## Number of columns in the phantom
-        self.num_of_cols = self.phantom.shape[0]
-
         ## Format of phantom (e.g. k-Wave compatible)
         self.phantom_format = config["phantom_format"].lower()
 
@@ -57,276 +55,386 @@ class Phantom():
         ## Density of the tissue - set to 1000 kg/m^3
         self.rho0 = config.get("density_rho0_kg_per_m3", 1000)  # [kg/m^3]
 
-        ## 2-D array that will store the sound speed values (only for k-Wave format)
-        self.sound_speed_map = [[self.c0 for y in range(self.num_of_rows)] for x in range(self.num_of_cols)]
+        ## Number of rows in the phantom (read from the image for phantoms based on images)
+        self.num_of_rows = config.get("rows_y", 0)
 
-        ## 2-D array that will store the density values (only for k-Wave format)
-        self.density_map = [[self.rho0 for y in range(self.num_of_rows)] for x in range(self.num_of_cols)]
+        ## Number of columns in the phantom (read from the image for phantoms based on images)
+        self.num_of_cols = config.get("cols_x", 0)
 
-        self.generate_scatterers(config)
+        ## Number of slices in the phantom
+        self.num_of_z = config.get("depth_z", 1)
 
-    def generate_phantom_matrix(self, config, slice_z = 0):
-        """!
-        \brief Generates a 2-D phantom (structures + scatterers)
+        ## Seed of the random generators, so the same phantom can be generated again (random if not set)
+        self.seed = config.get("seed")
 
-        \param config The parsed configuration
-        \param slice_z Current slice of a 3-D phantom or 0 for a 2-D phantom
+        ## Structures added to every slice, as (type, structure, relative amplitude of the scatterers)
+        self.regions = []
+        if config.get("image_path", "") == "":
+            self.regions = self.create_structures(config["structures"])
 
-        \note Raises an exception if no known structure is specified
-        """
+        ## 2-D array that stores the scatterers amplitude
+        self.phantom = None
 
-        # Use config.distribution and config.perc_of_scatterers to generate a phantom with the desired distribution
-        # Iterate through structures and fill the desired areas
+        ## 2-D array that stores the sound speed values (only for k-Wave format)
+        self.sound_speed_map = None
 
-        self.dist = config["distribution"].lower()
-        self.dens = config["perc_of_scatterers"]
-        self.num_of_rows = config["rows_y"]
-        self.num_of_cols = config["cols_x"]
-        self.phantom = np.zeros((self.num_of_cols, self.num_of_rows), dtype=np.complex_)
+        ## 2-D array that stores the density values (only for k-Wave format)
+        self.density_map = None
 
-        self.phantom_format = config["phantom_format"].lower()
+    def create_structures(self, structures):
+        """!
+        \brief Creates the objects of the structures defined in the configuration
 
-        self.c0 = config.get("sound_speed_c0_m_per_s", 1540)   # [m/s]
-        self.rho0 = config.get("density_rho0_kg_per_m3", 1000) # [kg/m^3]
+        \param structures The structures present in the configuration file
 
-        self.sound_speed_map = [[self.c0 for y in range(self.num_of_rows)] for x in range(self.num_of_cols)]
-        self.density_map = [[self.rho0 for y in range(self.num_of_rows)] for x in range(self.num_of_cols)]
+        \note Raises an exception if no known structure is specified
+
+        \return A list of (type, structure, relative amplitude of the scatterers)
+        """
 
-        self.generate_scatterers(config)
+        regions = []
 
-        for region in config["structures"]:
+        for region in structures:
             region_type = region["type"].lower()
-            ut.log_message("Adding " + region_type)
             if region_type == "circle":
-                circ = struc.Circle([struc.Point(region["center_xy"])], region["radius"])
-                circ.fill_area(self.phantom, self.sound_speed_map, self.density_map, region["scat_gain"], config)
+                structure = struc.Circle([struc.Point(region["center_xy"])], region["radius"])
             elif region_type == "ellipse":
-                ell = struc.Ellipse([struc.Point(region["center_xy"])], region["semi_axis_x"], region["semi_axis_y"], region["rotation_angle_deg"])
-                ell.fill_area(self.phantom, self.sound_speed_map, self.density_map, region["scat_gain"], config)
+                structure = struc.Ellipse([struc.Point(region["center_xy"])], region["semi_axis_x"], region["semi_axis_y"], region["rotation_angle_deg"])
             elif region_type == "sphere":
-                sphere = struc.Sphere([struc.Point(region["center_xyz"])], region["radius"])
-                sphere.fill_volume(self.phantom, slice_z, self.sound_speed_map, self.density_map, region["scat_gain"], config)
+                structure = struc.Sphere([struc.Point(region["center_xyz"])], region["radius"])
             elif region_type == "rectangle":
-                rec = struc.Rectangle([struc.Point((region["top_left_corner_xy"]))], region["length_x"], region["length_y"])
-                rec.fill_area(self.phantom, self.sound_speed_map, self.density_map, region["scat_gain"], config)
+                structure = struc.Rectangle([struc.Point((region["top_left_corner_xy"]))], region["length_x"], region["length_y"])
             elif region_type == "free_polygon":
-                polygon = []
-                for point in range(len(region["vertices_xy"])):
-                    polygon.append(struc.Point(region["vertices_xy"][point]))
-
-                poly = struc.Polygon(polygon)
-                poly.fill_area(self.phantom, self.sound_speed_map, self.density_map, region["scat_gain"], config)
+                structure = struc.Polygon([struc.Point(vertex) for vertex in region["vertices_xy"]])
             elif region_type == "points":
-                points = []
-                for point in range(len(region["coordinates_xy"])):
-                    points.append(struc.Point(region["coordinates_xy"][point]))
-
-                s_points = struc.SinglePoint(points)
-                s_points.fill_area(self.phantom, self.sound_speed_map, self.density_map, region["scat_gain"], config)
+                structure = struc.SinglePoint([struc.Point(point) for point in region["coordinates_xy"]])
             else:
                 raise Exception("Unknown structure defined: " + region_type)
 
-    def generate_scatterers(self, config):
+            regions.append((region_type, structure, region["scat_gain"]))
+
+        return regions
+
+    def generate_phantom_from_image(self, input_image):
+        """!
+        \brief Generates the scatterers of a phantom created from an image
+
+        \param input_image The image file used as reference to generate the phantom
+        """
+
+        # The pixels are kept in their original (integer) type until converted to complex
+        if input_image.lower().endswith('.dcm'):
+            pixels = dicom.dcmread(input_image).pixel_array
+        else:
+            # The file is only decoded on convert() and closed right after, so only the current image is kept in memory
+            with Image.open(input_image) as image:
+                pixels = np.asarray(image.convert('L'))
+
+        # Transposed (x, y) and converted in a single copy, so the array stays C-contiguous
+        self.phantom = np.ascontiguousarray(pixels.T, dtype=CMPLX)
+
+        self.num_of_rows = self.phantom.shape[1]
+        self.num_of_cols = self.phantom.shape[0]
+
+        self.sound_speed_map = np.full(self.phantom.shape, self.c0, dtype=np.float32)
+        self.density_map = np.full(self.phantom.shape, self.rho0, dtype=np.float32)
+
+        # Stream keyed on the name of the image, so each image of a directory gets its own scatterers, whatever the order
+        seed_sequence = np.random.SeedSequence(self.seed, spawn_key=(zlib.crc32(os.path.basename(input_image).encode()),))
+        self.generate_scatterers(self.phantom, np.random.default_rng(seed_sequence))
+
+    def generate_phantom_matrix(self, slice_z = 0):
+        """!
+        \brief Generates a 2-D phantom (structures + scatterers)
+
+        \param slice_z Current slice of a 3-D phantom or 0 for a 2-D phantom
+
+        \note The arrays are allocated on the first call and reused on the next ones
+        """
+
+        if self.phantom is None:
+            self.phantom = np.zeros((self.num_of_cols, self.num_of_rows), dtype=CMPLX)
+            self.sound_speed_map = np.empty((self.num_of_cols, self.num_of_rows), dtype=np.float32)
+            self.density_map = np.empty((self.num_of_cols, self.num_of_rows), dtype=np.float32)
+        else:
+            self.phantom.fill(0)
+
+        self.sound_speed_map.fill(self.c0)
+        self.density_map.fill(self.rho0)
+
+        self.fill_slice(self.phantom, self.sound_speed_map, self.density_map, slice_z)
+
+    def generate_phantom_volume(self, jobs = 1, slice_done = None):
+        """!
+        \brief Generates all the slices of a phantom (structures + scatterers), stored in 3-D arrays
+
+        \param jobs Number of processes used to generate the slices
+        \param slice_done Function called with the index of each slice as soon as the slice is complete (optional)
+
+        \note A 2-D phantom is generated as a volume with a single slice
+        """
+
+        # The arrays are not initialized here: the slices are either copied from the workers or initialized before being filled
+
+        ## 3-D array (z, x, y) that will store the scatterers amplitude of all slices
+        self.phantom_volume = np.empty((self.num_of_z, self.num_of_cols, self.num_of_rows), dtype=CMPLX)
+
+        ## 3-D array (z, x, y) that will store the sound speed values of all slices (only for k-Wave format)
+        self.sound_speed_volume = np.empty((self.num_of_z, self.num_of_cols, self.num_of_rows), dtype=np.float32)
+
+        ## 3-D array (z, x, y) that will store the density values of all slices (only for k-Wave format)
+        self.density_volume = np.empty((self.num_of_z, self.num_of_cols, self.num_of_rows), dtype=np.float32)
+
+        if jobs > 1 and self.num_of_z > 1:
+            # The slices are independent, so each one is generated in a separate process
+            with ProcessPoolExecutor(max_workers=min(jobs, self.num_of_z), initializer=_init_worker, initargs=(self.config,)) as executor:
+                slices = executor.map(_generate_slice, range(self.num_of_z))
+                for slice_z, (phantom, sound_speed_map, density_map) in enumerate(slices):
+                    self.phantom_volume[slice_z] = phantom
+                    self.sound_speed_volume[slice_z] = sound_speed_map
+                    self.density_volume[slice_z] = density_map
+                    if slice_done is not None:
+                        slice_done(slice_z)
+        else:
+            for slice_z in range(self.num_of_z):
+                ut.log_message("Generating slice %d", slice_z, verbose=self.verbose)
+
+                # The 2-D arrays are views of the current slice, so the slice is initialized and filled in place
+                self.phantom_volume[slice_z].fill(0)
+                self.sound_speed_volume[slice_z].fill(self.c0)
+                self.density_volume[slice_z].fill(self.rho0)
+                self.fill_slice(self.phantom_volume[slice_z], self.sound_speed_volume[slice_z], self.density_volume[slice_z], slice_z)
+                if slice_done is not None:
+                    slice_done(slice_z)
+
+    def fill_slice(self, phantom, sound_speed_map, density_map, slice_z):
+        """!
+        \brief Adds the scatterers and the structures to a slice
+
+        \param phantom 2-D array (x, y) where the scatterers amplitude will be stored
+        \param sound_speed_map 2-D array (x, y) where the sound speed values will be stored
+        \param density_map 2-D array (x, y) where the density values will be stored
+        \param slice_z Current slice of a 3-D phantom or 0 for a 2-D phantom
+
+        \note Each slice has its own random generator, so the result does not depend on the order the slices are generated
+        """
+
+        # Use config.distribution and config.perc_of_scatterers to generate a phantom with the desired distribution
+        # Iterate through structures and fill the desired areas
+
+        # Same stream as the child slice_z of SeedSequence(seed).spawn(), so the slices are statistically independent
+        seed_sequence = np.random.SeedSequence(self.seed, spawn_key=(slice_z,))
+        self.generate_scatterers(phantom, np.random.default_rng(seed_sequence))
+
+        for region_type, structure, scat_gain in self.regions:
+            ut.log_message("Adding %s", region_type)
+            if region_type == "sphere":
+                structure.fill_volume(phantom, slice_z, sound_speed_map, density_map, scat_gain, self.config)
+            else:
+                structure.fill_area(phantom, sound_speed_map, density_map, scat_gain, self.config)
+
+    def generate_scatterers(self, phantom, rng):
         """!
         \brief Generates the scatterers added to the phantom
 
-        \param config The parsed configuration
+        \param phantom 2-D array (x, y) where the scatterers will be stored
+        \param rng The numpy random generator used to create the scatterers
 
         \note Raises an exception if no known distribution is specified
         """
 
         k = round((self.dens/100)*self.num_of_rows*self.num_of_cols) # Absolute number of scatterers
 
-        ut.log_message("Using distribution " + self.dist)
+        ut.log_message("Using distribution %s", self.dist)
 
-        x = np.random.uniform(size=(k))
-        y = np.random.uniform(size=(k))
+        # Position of each scatterer, drawn directly as indexes of the phantom
+        x = rng.integers(0, self.num_of_cols, size=k)
+        y = rng.integers(0, self.num_of_rows, size=k)
 
+        # Amplitude of each scatterer
         if self.dist == "uniform":
-            amp = np.random.uniform(size=(k))
-            phase = 2*math.pi*np.random.uniform(size=(k))
+            amp = rng.random(size=(k))
         elif self.dist == "gaussian":
-            amp = np.random.normal(loc=1, scale=0.008, size=(k))
-            phase = 2*math.pi*np.random.normal(loc=1, scale=0.008, size=(k))
+            amp = rng.normal(loc=1, scale=0.008, size=(k))
         elif self.dist == "rayleigh":
-            amp = np.random.rayleigh(scale=2, size=(k))
-            phase = 2*math.pi*np.random.rayleigh(scale=2, size=(k))
+            amp = rng.rayleigh(scale=2, size=(k))
         else:
             raise Exception("Unknown distribution defined: " + self.dist)
 
-        x = x - np.amin(x)
-        max_x = np.amax(abs(x))
-        x = x/max_x
-        max_x = np.amax(abs(x))
-        x = (np.around((self.num_of_cols - 1)*(x/max_x))).astype(int)
-
-        y = y - np.amin(y)
-        max_y = np.amax(abs(y))
-        y = y/max_y
-        max_y = np.amax(abs(y))
-        y = (np.around((self.num_of_rows - 1)*(y/max_y))).astype(int)
+        # The phase is uniform in [0, 2*pi) whatever the distribution of the amplitudes
+        phase = rng.uniform(0, 2*math.pi, size=(k))
 
-        # Complex random scatterers
-        scatterers = [0 for i in range(k)]
-
-        for i in range(k):
-            if mod(i, 10000) == 0:
-                ut.log_message("Generating scatterer " + str(i) + "/" + str(k), config.get("verbose", False))
-
-            scatterers[i] = complex(amp[i]*math.cos(phase[i]), amp[i]*math.sin(phase[i]))  # Complex scatterers (real and imaginary part)
+        # Complex random scatterers (real and imaginary part)
+        ut.log_message("Generating %d scatterers", k, verbose=self.verbose)
+        scatterers = amp*(np.cos(phase) + 1j*np.sin(phase))
 
         # Distribution of the scatterers along the image
-        for i in range(k):
-            if mod(i, 10000) == 0:
-                ut.log_message("Storing scatterer " + str(i) + "/" + str(k), config.get("verbose", False))
-
-            self.phantom[x[i]][y[i]] = scatterers[i]
+        phantom[x, y] = scatterers
+        ut.log_message("Stored %d scatterers", k, verbose=self.verbose)
 
-    def save_all(self, output_format, full_path):
+    def save_all(self, output_format, full_path, slice_z = None):
         """!
         \brief Saves the phantom in all possible formats
 
         \param output_format Format to save the phantom ('t' - txt, 'm' - mat or 'p' - png)
         \param full_path Full path (folder + filename) without extension
+        \param slice_z Slice of the volume created by generate_phantom_volume to be saved. If not set, the current 2-D phantom is saved
+
+        \note Different slices can be saved at the same time from different threads
         """
 
+        if slice_z is None:
+            phantom = self.phantom
+            sound_speed_map = self.sound_speed_map
+            density_map = self.density_map
+        else:
+            phantom = self.phantom_volume[slice_z]
+            sound_speed_map = self.sound_speed_volume[slice_z]
+            density_map = self.density_volume[slice_z]
+
         if 't' in output_format:
-            self.save_txt_file(full_path)
+            self.save_txt_file(full_path, phantom)
         if 'm' in output_format:
-            self.save_mat_file(full_path)
+            self.save_mat_file(full_path, phantom, sound_speed_map, density_map)
         if 'p' in output_format:
-            self.save_png_image(full_path)
+            self.save_png_image(full_path, phantom, sound_speed_map, density_map)
 
-    def save_txt_file(self, output_path_name):
+    def save_txt_file(self, output_path_name, phantom):
         """!
         \brief Saves the phantom in a text file
 
         \param output_path_name Full path (folder + filename) without extension
+        \param phantom The 2-D array with the scatterers amplitude
         """
 
         full_path = os.path.join(output_path_name + ".txt")
-        ut.log_message("Saving text file to to " + full_path)
-        np.savetxt(full_path, self.phantom)
+        ut.log_message("Saving text file to to %s", full_path)
+        np.savetxt(full_path, phantom)
 
-    def create_mat_file(self, data):
+    def create_mat_file(self, full_path, data):
         """!
         \brief Saves data in a mat file. Array name is fixed as 'arr'
 
+        \param full_path The path + complete filename of the mat file that will be created
         \param data Data to be stored in the mat file
         """
 
-        temp = np.array(data)
-        temp = np.transpose(temp)
-        scipy.io.savemat(self.full_path, mdict={'arr': temp})
+        scipy.io.savemat(full_path, mdict={'arr': np.transpose(data)}, do_compression=True, oned_as='column')
 
-    def save_mat_file(self, output_path_name):
+    def save_mat_file(self, output_path_name, phantom, sound_speed_map, density_map):
         """!
         \brief Saves the 2-D phantom in a mat file. Extra outputs are saved for k-Wave phantom
 
         \param output_path_name Full path (folder + filename) without extension
+        \param phantom The 2-D array with the scatterers amplitude
+        \param sound_speed_map The 2-D array with the sound speed values
+        \param density_map The 2-D array with the density values
         """
 
-        ## The path + complete filename of the mat file that will be created
-        self.full_path = os.path.join(output_path_name + ".mat")
-        ut.log_message("Saving phantom as mat file to " + self.full_path)
-        self.create_mat_file(self.phantom)
+        full_path = os.path.join(output_path_name + ".mat")
+        ut.log_message("Saving phantom as mat file to %s", full_path)
+        self.create_mat_file(full_path, phantom)
 
         if self.phantom_format == "k_wave":
-            self.full_path = os.path.join(output_path_name + "_sound_speed_map.mat")
-            ut.log_message("Saving phantom sound speed map as mat file to " + self.full_path)
-            self.create_mat_file(self.sound_speed_map)
+            full_path = os.path.join(output_path_name + "_sound_speed_map.mat")
+            ut.log_message("Saving phantom sound speed map as mat file to %s", full_path)
+            self.create_mat_file(full_path, sound_speed_map)
 
-            self.full_path = os.path.join(output_path_name + "_density_map.mat")
-            ut.log_message("Saving phantom density map as mat file to " + self.full_path)
-            self.create_mat_file(self.density_map)
+            full_path = os.path.join(output_path_name + "_density_map.mat")
+            ut.log_message("Saving phantom density map as mat file to %s", full_path)
+            self.create_mat_file(full_path, density_map)
 
-    def create_png_image(self, data):
+    def create_png_image(self, full_path, data):
         """!
         \brief Creates the png file on disk
 
+        \param full_path The path + complete filename of the png file that will be created
         \param data Data to be stored in the png file
         """
 
-        temp = np.transpose(data)
-        temp = abs(temp)
-        min_t = np.amin(temp)
-        temp = temp - min_t
+        # Single temporary, normalized in place
+        temp = np.abs(np.transpose(data))
+        temp -= np.amin(temp)
+
+        # A constant array (e.g. a map without structures) is saved as a black image
         data_max = np.amax(temp)
-        normalized = temp*255/data_max
-        normalized = normalized.astype(np.uint8)
+        if data_max > 0:
+            temp *= 255/data_max
 
-        matplotlib.pyplot.imsave(self.full_path, normalized, cmap='gray')
+        matplotlib.image.imsave(full_path, temp.astype(np.uint8), cmap='gray')
 
-    def save_png_image(self, output_path_name):
+    def save_png_image(self, output_path_name, phantom, sound_speed_map, density_map):
         """!
         \brief Saves the 2-D phantom in a png file. Extra outputs are saved for k-Wave phantom
 
         \param output_path_name Full path (folder + filename) without extension
+        \param phantom The 2-D array with the scatterers amplitude
+        \param sound_speed_map The 2-D array with the sound speed values
+        \param density_map The 2-D array with the density values
         """
 
-        self.full_path = os.path.join(output_path_name + ".png")
-        ut.log_message("Saving phantom image to " + self.full_path)
-        temp = np.array(self.phantom)
-        self.create_png_image(temp)
+        full_path = os.path.join(output_path_name + ".png")
+        ut.log_message("Saving phantom image to %s", full_path)
+        self.create_png_image(full_path, phantom)
 
         if self.phantom_format == "k_wave":
-            self.full_path = os.path.join(output_path_name + "_density_map.png")
-            ut.log_message("Saving phantom density map as image to " + self.full_path)
-            temp = np.array(self.density_map)
-            self.create_png_image(temp)
+            full_path = os.path.join(output_path_name + "_density_map.png")
+            ut.log_message("Saving phantom density map as image to %s", full_path)
+            self.create_png_image(full_path, density_map)
 
-            self.full_path = os.path.join(output_path_name + "_sound_speed_map.png")
-            ut.log_message("Saving phantom sound map as image to " + self.full_path)
-            temp = np.array(self.sound_speed_map)
-            self.create_png_image(temp)
+            full_path = os.path.join(output_path_name + "_sound_speed_map.png")
+            ut.log_message("Saving phantom sound map as image to %s", full_path)
+            self.create_png_image(full_path, sound_speed_map)
 
-    def generate_final_output(self, configuration, name_path_prefix):
+    def generate_final_output(self, name_path_prefix):
         """!
-        \brief Generates a final mat file when multiples mat files are created during processing
+        \brief Generates the final mat files of a 3-D phantom, written directly from the volume created by generate_phantom_volume
 
-        \param configuration Parsed configuration
         \param name_path_prefix Path + filename prefix
         """
 
-        num_of_z = configuration.get("depth_z", 1)
-        if num_of_z == 1:
-            # There is no file to append
+        if self.num_of_z == 1:
+            # The 2-D phantom was already saved
             return
 
-        phantom_format = configuration["phantom_format"].lower()
+        if self.phantom_format == "k_wave":
+            # The volumes are stored as (z, x, y), so they are transposed to (y, x, z), i.e. (rows, columns, slices)
+            ut.log_message("Creating final 3-D phantom %s.mat", name_path_prefix)
+            scipy.io.savemat(name_path_prefix + ".mat", mdict={"phantom": np.transpose(self.phantom_volume)}, do_compression=True)
 
-        ## Set to True if the message should be logged
-        self.verbose = configuration["verbose"]
+            ut.log_message("Creating 3-D sound speed map %s_sound_speed_map.mat", name_path_prefix)
+            scipy.io.savemat(name_path_prefix + "_sound_speed_map.mat", mdict={"sound_speed_map": np.transpose(self.sound_speed_volume)}, do_compression=True)
 
-        if phantom_format == "k_wave":
-            # Split in three loops to save memory
-            ut.log_message("Creating final 3-D phantom " + name_path_prefix + ".mat")
-            self.mat_2d_to_3d(name_path_prefix, "", num_of_z, "phantom")
+            ut.log_message("Creating 3-D density map %s_density_map.mat", name_path_prefix)
+            scipy.io.savemat(name_path_prefix + "_density_map.mat", mdict={"density_map": np.transpose(self.density_volume)}, do_compression=True)
 
-            ut.log_message("Creating 3-D sound speed map " + name_path_prefix + "_sound_speed_map.mat")
-            self.mat_2d_to_3d(name_path_prefix, "_sound_speed_map", num_of_z, "sound_speed_map")
 
-            ut.log_message("Creating 3-D density map " + name_path_prefix + "_density_map.mat")
-            self.mat_2d_to_3d(name_path_prefix, "_density_map", num_of_z, "density_map")
+## Phantom of a worker process, reused for all the slices generated by the process
+_worker_phantom = None
 
-    def mat_2d_to_3d(self, name_path_prefix, postfix, num_of_slices, array_name):
-        """!
-        \brief Loads a series of 2-D mat files and generate a final 3-D file
 
-        \param name_path_prefix Path + filename prefix
-        \param postfix String to append to the filename
-        \param num_of_slices Total number of slices in the 3-D phantom
-        \param array_name Name to used internally in the .mat file
-        """
+def _init_worker(config):
+    """!
+    \brief Creates the phantom of a worker process that generates slices
+
+    \param config The parsed configuration
+    """
+
+    global _worker_phantom
+    _worker_phantom = Phantom(config)
+
+
+def _generate_slice(slice_z):
+    """!
+    \brief Generates one slice of a phantom with the phantom of the worker process. Used to generate the slices in parallel processes
+
+    \param slice_z Slice of the 3-D phantom to be generated
+
+    \return The 2-D arrays (x, y) of the slice: phantom, sound speed map and density map
+    """
 
-        data = scipy.io.loadmat(name_path_prefix + "_slice_0" + postfix + ".mat")
-        mx = data['arr']  # Matrix MxN
-        volume = mx[..., np.newaxis]  # Volume MxNx1
+    ut.log_message("Generating slice %d", slice_z, verbose=_worker_phantom.verbose)
 
-        for slice_z in range(1, num_of_slices):
-            ut.log_message("Appending slice " + str(slice_z), self.verbose)
-            data = scipy.io.loadmat(name_path_prefix + "_slice_" + str(slice_z) + postfix + ".mat")
-            mx = data['arr']
-            volume = np.dstack((volume, mx[..., np.newaxis]))
+    _worker_phantom.generate_phantom_matrix(slice_z)
 
-        scipy.io.savemat(name_path_prefix + postfix + ".mat", mdict={array_name:volume})
+    return _worker_phantom.phantom, _worker_phantom.sound_speed_map, _worker_phantom.density_map
@@ -4,12 +4,60 @@
 \brief Contains the definitions of the structures that are added to a phantom
 """
 
-from numpy import mod
-import utils as ut
+import numpy as np
 import math
 
+## Ratio between the density and the sound speed inside the structures of k-Wave phantoms
+DENSITY_PER_SOUND_SPEED = 1/1.5
+
+
 # https://github.com/JoJocoder/PNPOLY/blob/master/pnpoly.py
 # Originally from https://wrf.ecse.rpi.edu/Research/Short_Notes/pnpoly.html
+def points_in_polygon(x, y, vertices_xy):
+    """!
+    \brief Checks which points are inside a polygon (crossing test, PNPOLY)
+
+    \param x Coordinates of the points in the x (columns) direction (a number or a NumPy array)
+    \param y Coordinates of the points in the y (rows) direction (a number or a NumPy array, broadcastable with x)
+    \param vertices_xy Coordinates (x, y) of the vertices of the polygon
+
+    \return A boolean array, True for the points inside the polygon
+    """
+
+    vertices_xy = np.asarray(vertices_xy).reshape(-1, 2)
+    is_inside = np.zeros(np.broadcast(x, y).shape, dtype=bool)
+
+    # Each edge goes from vertex j (the previous one) to vertex i
+    x_i, y_i = vertices_xy[:, 0].astype(float), vertices_xy[:, 1].astype(float)
+    x_j, y_j = np.roll(x_i, 1), np.roll(y_i, 1)
+
+    # Horizontal edges are never crossed
+    crossed = y_i != y_j
+    edges = zip(x_i[crossed].tolist(), y_i[crossed].tolist(), x_j[crossed].tolist(), y_j[crossed].tolist())
+
+    for edge_x_i, edge_y_i, edge_x_j, edge_y_j in edges:
+        is_inside ^= ((edge_y_i > y) != (edge_y_j > y)) & (x < (edge_x_j - edge_x_i)*(y - edge_y_i)/(edge_y_j - edge_y_i) + edge_x_i)
+
+    return is_inside
+
+
+def batch_errors(invalid_size, out_of_bounds, size_error, bounds_error):
+    """!
+    \brief Builds the error string of several structures validated at once, with the same messages and order as validating them one by one
+
+    \param invalid_size Boolean array, True for the structures with an invalid size
+    \param out_of_bounds Boolean array, True for the structures out of bounds of the phantom
+    \param size_error Message of the structures with an invalid size
+    \param bounds_error Message of the structures out of bounds of the phantom
+
+    \return An empty string if all structures are valid; an error string per invalid structure otherwise
+    """
+
+    errors = np.where(invalid_size, size_error, np.where(out_of_bounds, bounds_error, ""))
+
+    return "".join(errors.tolist())
+
+
 class Point():
     """!
     \brief Class used as reference for Polygons
@@ -49,16 +97,15 @@ class Point():
         \return True if the point is inside the polygon; False otherwise
         """
 
-        is_inside = False
+        vertices_xy = np.array([(point.x, point.y) for point in polygon]).reshape(-1, 2)
 
-        j = len(polygon) - 1
-        for i in range(len(polygon)):
-            if ((polygon[i].y > self.y) != (polygon[j].y > self.y) and \
-                (self.x < (polygon[j].x - polygon[i].x)*(self.y - polygon[i].y)/(polygon[j].y - polygon[i].y) + polygon[i].x)):
-                is_inside = not is_inside
-            j = i
+        # A point outside the bounding box of the polygon can not be inside it
+        min_x, min_y = vertices_xy.min(axis=0)
+        max_x, max_y = vertices_xy.max(axis=0)
+        if self.x < min_x or self.x > max_x or self.y < min_y or self.y > max_y:
+            return False
 
-        return is_inside
+        return bool(points_in_polygon(self.x, self.y, vertices_xy))
 
 
 class Structure():
@@ -77,6 +124,30 @@ class Structure():
         ## Point(s) defining a structure
         self.origins = origins
 
+    @staticmethod
+    def validate_batch(points_xy, num_of_points, num_of_rows, num_of_cols):
+        """!
+        \brief Checks if the points of several structures are inside the phantom
+
+        \param points_xy Coordinates (x, y) of the points of all structures, one structure after the other
+        \param num_of_points Number of points of each structure
+        \param num_of_rows Number of rows in the phantom
+        \param num_of_cols Number of columns in the phantom
+
+        \return An empty string if all points are inside the phantom; an error string per invalid structure otherwise
+        """
+
+        # x: cols, y:rows
+        points_xy = np.asarray(points_xy).reshape(-1, 2)
+        out_of_bounds = ((points_xy[:, 0] < 0) | (points_xy[:, 0] > num_of_cols - 1) |
+                         (points_xy[:, 1] < 0) | (points_xy[:, 1] > num_of_rows - 1))
+
+        # Index of the structure each point belongs to
+        structure_index = np.repeat(np.arange(len(num_of_points)), np.asarray(num_of_points, dtype=int))
+        num_of_invalid = np.unique(structure_index[out_of_bounds]).size
+
+        return "The defined points are out of bounds of the phantom.\r\n" * num_of_invalid
+
     def validate(self, num_of_rows, num_of_cols):
         """!
         \brief Checks if a given point is inside the phantom
@@ -87,59 +158,53 @@ class Structure():
         \return An empty string if the point is inside the phantom; an error string otherwise
         """
 
-        # x: cols, y:rows
-        for point in self.origins:
-            if ((point.x < 0 or point.x > num_of_cols - 1) or
-               (point.y < 0 or point.y > num_of_rows - 1)):
-                return "The defined points are out of bounds of the phantom.\r\n"
+        points_xy = [(point.x, point.y) for point in self.origins]
 
-        return ""
+        return Structure.validate_batch(points_xy, [len(points_xy)], num_of_rows, num_of_cols)
 
     def calculate_scattering_c0(self, amplitude, config):
         """!
         \brief Computes values for sound speed map used in k-Wave phantoms
 
-        \param amplitude Amplitude of the scatterer
+        \param amplitude Amplitude of the scatterer (or a NumPy array of amplitudes)
         \param config The parsed configuration
 
-        \return The sound speed in the requested position
+        \return The sound speed in the requested position (an array if an array of amplitudes is given)
         """
 
-        c0 = config.get("sound_speed_c0_m_per_s", 1540)
-
-        scattering_c0 = c0 + 25 + 75 * amplitude
-
-        if scattering_c0 > 1600:
-            scattering_c0 = 1600
+        # Sound speed of a structure without scatterers
+        base_c0 = config.get("sound_speed_c0_m_per_s", 1540) + 25
 
-        if scattering_c0 < 1400:
-            scattering_c0 = 1400
+        # Computed and clipped in a single output buffer, without copying the amplitudes
+        scattering_c0 = np.empty(np.shape(amplitude), dtype=np.float32)
+        np.multiply(amplitude, 75, out=scattering_c0)
+        scattering_c0 += base_c0
 
-        return scattering_c0
+        return np.clip(scattering_c0, 1400, 1600, out=scattering_c0)
 
     def fill_structure(self, phantom, pos_x, pos_y, scat_gain, sound_speed_map, density_map, config):
         """!
         \brief Defines the values inside a generic structure
 
         \param phantom  The 2-D array where the scatterers amplitude will be stored
-        \param pos_x X coordinate of current scatterer
-        \param pos_y Y coordinate of current scatterer
+        \param pos_x X coordinate of current scatterer (or a NumPy array / slice with the coordinates of several scatterers)
+        \param pos_y Y coordinate of current scatterer (or a NumPy array / slice with the coordinates of several scatterers)
         \param scat_gain The gain of the scatterers inside the sphere
         \param sound_speed_map The 2-D array where the sound values will be stored
         \param density_map The 2-D array where the density values will be stored
         \param config The parsed configuration
         """
 
-        phantom[pos_x][pos_y] = phantom[pos_x][pos_y] * scat_gain
+        scatterers = phantom[pos_x, pos_y] * scat_gain
+        phantom[pos_x, pos_y] = scatterers
 
-        ## Type of phantom
-        self.phantom_format = config["phantom_format"].lower()
+        # Called once per structure, so the format is read from the configuration once per fill
+        if config["phantom_format"].lower() == "k_wave":
+            scattering_c0 = self.calculate_scattering_c0(np.abs(scatterers), config)
 
-        if self.phantom_format == "k_wave":
-            scattering_c0 = self.calculate_scattering_c0(abs(phantom[pos_x][pos_y]), config)
-
-            sound_speed_map[pos_x][pos_y] = scattering_c0
-            density_map[pos_x][pos_y] = scattering_c0 / 1.5
+            sound_speed_map[pos_x, pos_y] = scattering_c0
+            scattering_c0 *= DENSITY_PER_SOUND_SPEED
+            density_map[pos_x, pos_y] = scattering_c0
 
 
 class Circle(Structure):
@@ -161,6 +226,29 @@ class Circle(Structure):
         ## Radius of the circle
         self.radius = args[0]
 
+    @staticmethod
+    def validate_batch(centers_xy, radii, num_of_rows, num_of_cols):
+        """!
+        \brief Validates the configuration of several circles at once
+
+        \param centers_xy Coordinates (x, y) of the center of each circle
+        \param radii Radius of each circle
+        \param num_of_rows Number of rows in the phantom
+        \param num_of_cols Number of columns in the phantom
+
+        \return An empty string if the circles configuration is valid; an error string per invalid circle otherwise
+        """
+
+        centers_xy = np.asarray(centers_xy).reshape(-1, 2)
+        radii = np.asarray(radii)
+
+        invalid_radius = radii <= 0
+        out_of_bounds = ~invalid_radius & ((centers_xy[:, 1] + radii > num_of_rows - 1) | (centers_xy[:, 0] + radii > num_of_cols - 1) |
+                                           (centers_xy[:, 0] - radii < 0) | (centers_xy[:, 1] - radii < 0))
+
+        return batch_errors(invalid_radius, out_of_bounds, "Circle radius must be greater than zero",
+                            "The defined circle is out of bounds of the phantom.\r\n")
+
     def validate(self, num_of_rows, num_of_cols):
         """!
         \brief Validates the circle configuration
@@ -171,13 +259,7 @@ class Circle(Structure):
         \return An empty string if the circle configuration is valid; an error string otherwise
         """
 
-        if (self.radius <= 0):
-            return "Circle radius must be greater than zero"
-        elif ((self.center.y + self.radius > num_of_rows - 1) or (self.center.x + self.radius > num_of_cols - 1) or
-           (self.center.x - self.radius < 0) or (self.center.y - self.radius < 0)):
-            return "The defined circle is out of bounds of the phantom.\r\n"
-        else:
-            return ""
+        return Circle.validate_batch([(self.center.x, self.center.y)], [self.radius], num_of_rows, num_of_cols)
 
     def fill_area(self, phantom, sound_speed_map, density_map, scat_gain, config):
         """!
@@ -191,13 +273,16 @@ class Circle(Structure):
         """
 
         # Create a rectangle and, inside it, search for points that are inside the circle
-        top_x = self.center.x - self.radius
-        top_y = self.center.y - self.radius
+        # The rectangle is clamped to the phantom, so negative indices never wrap around to the other side
+        top_x = max(self.center.x - self.radius, 0)
+        top_y = max(self.center.y - self.radius, 0)
+        bottom_x = min(self.center.x + self.radius, phantom.shape[0])
+        bottom_y = min(self.center.y + self.radius, phantom.shape[1])
 
-        for x in range(top_x, top_x + 2*self.radius):
-            for y in range(top_y, top_y + 2*self.radius):
-                if pow((x - self.center.x), 2) + pow((y - self.center.y), 2) <= pow(self.radius, 2):
-                    self.fill_structure(phantom, x, y, scat_gain, sound_speed_map, density_map, config)
+        x, y = np.ogrid[top_x:bottom_x, top_y:bottom_y]
+        inside_x, inside_y = np.nonzero((x - self.center.x)**2 + (y - self.center.y)**2 <= self.radius**2)
+
+        self.fill_structure(phantom, top_x + inside_x, top_y + inside_y, scat_gain, sound_speed_map, density_map, config)
 
 
 class Ellipse(Structure):
@@ -228,22 +313,32 @@ class Ellipse(Structure):
         self.min_y = self.center.y + major_length
         self.max_y = self.center.y - major_length
 
-        for x in range(self.center.x - major_length, self.center.x + major_length):
-            for y in range(self.center.y - major_length, self.center.y + major_length):
-                if self.is_point_in_ellipse(x, y):
-                    self.min_x = min(self.min_x, x)
-                    self.min_y = min(self.min_y, y)
-                    self.max_x = max(self.max_x, x)
-                    self.max_y = max(self.max_y, y)
+        if (self.semi_axis_x <= 0) or (self.semi_axis_y <= 0):
+            # Invalid ellipse, there is no area to search
+            return
+
+        # Test all points of the square around the ellipse at once and keep the extent of those inside it
+        top_x = self.center.x - major_length
+        top_y = self.center.y - major_length
+        x, y = np.ogrid[top_x:self.center.x + major_length, top_y:self.center.y + major_length]
+        is_inside = self.is_point_in_ellipse(x, y)
+
+        cols_inside = np.flatnonzero(is_inside.any(axis=1))
+        rows_inside = np.flatnonzero(is_inside.any(axis=0))
+        if cols_inside.size > 0:
+            self.min_x = top_x + int(cols_inside[0])
+            self.max_x = top_x + int(cols_inside[-1])
+            self.min_y = top_y + int(rows_inside[0])
+            self.max_y = top_y + int(rows_inside[-1])
 
     def is_point_in_ellipse(self, x, y):
         """!
         \brief Checks if a given point (x, y) is part of an ellipse (inside or in the line)
 
-        \param x Point coordinate in the x (columns) direction
-        \param y Point coordinate in the y (rows) direction
+        \param x Point coordinate in the x (columns) direction (or a NumPy array of coordinates)
+        \param y Point coordinate in the y (rows) direction (or a NumPy array of coordinates)
 
-        \return True in case the point in part of the ellipse area
+        \return True in case the point in part of the ellipse area (a boolean array if arrays are given)
         """
         h = self.center.x
         k = self.center.y
@@ -285,10 +380,10 @@ class Ellipse(Structure):
         """
 
         # Create a rectangle and, inside it, search for points that are inside the ellipse
-        for x in range(self.min_x, self.max_x):
-            for y in range(self.min_y, self.max_y):
-                if self.is_point_in_ellipse(x, y):
-                    self.fill_structure(phantom, x, y, scat_gain, sound_speed_map, density_map, config)
+        x, y = np.ogrid[self.min_x:self.max_x, self.min_y:self.max_y]
+        inside_x, inside_y = np.nonzero(self.is_point_in_ellipse(x, y))
+
+        self.fill_structure(phantom, self.min_x + inside_x, self.min_y + inside_y, scat_gain, sound_speed_map, density_map, config)
 
 
 class Rectangle(Structure):
@@ -313,6 +408,30 @@ class Rectangle(Structure):
         ## Height of the rectangle
         self.vertical_length = args[1]
 
+    @staticmethod
+    def validate_batch(corners_xy, lengths_xy, num_of_rows, num_of_cols):
+        """!
+        \brief Validates the configuration of several rectangles at once
+
+        \param corners_xy Coordinates (x, y) of the top left corner of each rectangle
+        \param lengths_xy Horizontal and vertical lengths of each rectangle
+        \param num_of_rows Number of rows in the phantom
+        \param num_of_cols Number of columns in the phantom
+
+        \return An empty string if the rectangles configuration is valid; an error string per invalid rectangle otherwise
+        """
+
+        corners_xy = np.asarray(corners_xy).reshape(-1, 2)
+        lengths_xy = np.asarray(lengths_xy).reshape(-1, 2)
+
+        invalid_length = (lengths_xy[:, 0] <= 0) | (lengths_xy[:, 1] <= 0)
+        out_of_bounds = ~invalid_length & ((corners_xy[:, 1] + lengths_xy[:, 1] > num_of_rows - 1) |
+                                           (corners_xy[:, 0] + lengths_xy[:, 0] > num_of_cols - 1) |
+                                           (corners_xy[:, 0] < 0) | (corners_xy[:, 1] < 0))
+
+        return batch_errors(invalid_length, out_of_bounds, "Rectangle dimensions must be greater than zero",
+                            "The defined rectangle is out of bounds of the phantom.\r\n")
+
     def validate(self, num_of_rows, num_of_cols):
         """!
         \brief Validates the configuration
@@ -323,14 +442,8 @@ class Rectangle(Structure):
         \return An empty string if the rectangle configuration is valid; an error string otherwise
         """
 
-        if (self.horizontal_length <= 0 or self.vertical_length <= 0):
-            return "Rectangle dimensions must be greater than zero"
-        elif ((self.top_left_corner.y + self.vertical_length > num_of_rows - 1) or
-           (self.top_left_corner.x + self.horizontal_length > num_of_cols - 1) or
-           (self.top_left_corner.x < 0) or (self.top_left_corner.y < 0)):
-           return "The defined rectangle is out of bounds of the phantom.\r\n"
-        else:
-            return ""
+        return Rectangle.validate_batch([(self.top_left_corner.x, self.top_left_corner.y)], [(self.horizontal_length, self.vertical_length)],
+                                        num_of_rows, num_of_cols)
 
     def fill_area(self, phantom, sound_speed_map, density_map, scat_gain, config):
         """!
@@ -343,11 +456,10 @@ class Rectangle(Structure):
         \param config The parsed configuration
         """
 
-        for x in range(self.top_left_corner.x, self.top_left_corner.x + self.horizontal_length):
-            if mod(x, 10) == 0:
-                ut.log_message("Filling column " + str(x) + ". Range from " + str(self.top_left_corner.x) + " to " + str(self.top_left_corner.x + self.horizontal_length), config.get("verbose", False))
-            for y in range(self.top_left_corner.y, self.top_left_corner.y + self.vertical_length):
-                self.fill_structure(phantom, x, y, scat_gain, sound_speed_map, density_map, config)
+        columns = slice(self.top_left_corner.x, self.top_left_corner.x + self.horizontal_length)
+        rows = slice(self.top_left_corner.y, self.top_left_corner.y + self.vertical_length)
+
+        self.fill_structure(phantom, columns, rows, scat_gain, sound_speed_map, density_map, config)
 
 
 class Polygon(Structure):
@@ -355,6 +467,23 @@ class Polygon(Structure):
     \brief Free-form polygon
     """
 
+    def __init__(self, origins, *args):
+        """!
+        \brief Sets the vertices of the polygon
+
+        \param origins The points defining the vertices of the polygon
+        \param args Unused
+        """
+
+        super().__init__(origins)
+
+        ## Coordinates (x, y) of the vertices, converted once so they are not read from the points for every slice
+        self.vertices_xy = np.array([(point.x, point.y) for point in origins], dtype=int).reshape(-1, 2)
+
+        ## Corners (x, y) of the bounding box of the polygon, the only area where pixels can be inside it
+        self.min_xy = self.vertices_xy.min(axis=0)
+        self.max_xy = self.vertices_xy.max(axis=0)
+
     def fill_area(self, phantom, sound_speed_map, density_map, scat_gain, config):
         """!
         \brief Fills the are inside the polygon
@@ -366,29 +495,18 @@ class Polygon(Structure):
         \param config The parsed configuration
         """
 
-        # Find max, min of x and y
-        min_x = 0
-        max_x = 0
-        min_y = 0
-        max_y = 0
+        vertices_xy = self.vertices_xy
 
-        for point in self.origins:
-            min_x = min(point.x, min_x)
-            max_x = max(point.x, max_x)
-            min_y = min(point.y, min_y)
-            max_y = max(point.y, max_y)
+        min_x, min_y = self.min_xy
+        max_x, max_y = self.max_xy
 
         # Check if every pixel in this range is inside the polygon, if so, apply gain
         # This is done to reduce the are for test without looking for complex
         # algorithms to determine the area
-        for x in range(min_x, max_x):
-            if mod(x, 10) == 0:
-                ut.log_message("Filling column " + str(x) + ". Range from " + str(min_x) + " to " + str(max_x), config.get("verbose", False))
-            for y in range(min_y, max_y):
-                point = Point((x, y))
-                if point.in_polygon(self.origins):
-                    # Point is inside the polygon
-                    self.fill_structure(phantom, point.x, point.y, scat_gain, sound_speed_map, density_map, config)
+        x, y = np.ogrid[min_x:max_x, min_y:max_y]
+        inside_x, inside_y = np.nonzero(points_in_polygon(x, y, vertices_xy))
+
+        self.fill_structure(phantom, min_x + inside_x, min_y + inside_y, scat_gain, sound_speed_map, density_map, config)
 
 
 class SinglePoint(Structure):
@@ -403,16 +521,19 @@ class SinglePoint(Structure):
         \param phantom The 2-D array where the scatterers amplitude will be stored
         \param sound_speed_map The 2-D array where the sound values will be stored
         \param density_map The 2-D array where the density values will be stored
-        \param scat_gain The gain of the scatterers inside the sphere
+        \param scat_gain The gain of the scatterers (a number or one gain per point)
         \param config The parsed configuration
         """
 
-        for point in self.origins:
-            # Make sure there's a scatterer in this location
-            if phantom[point.x][point.y] == 0:
-                phantom[point.x][point.y] = 1
+        # All the points are filled at once
+        points_x = np.fromiter((point.x for point in self.origins), dtype=int, count=len(self.origins))
+        points_y = np.fromiter((point.y for point in self.origins), dtype=int, count=len(self.origins))
 
-            self.fill_structure(phantom, point.x, point.y, scat_gain, sound_speed_map, density_map, config)
+        # Make sure there's a scatterer in these locations
+        no_scatterer = phantom[points_x, points_y] == 0
+        phantom[points_x[no_scatterer], points_y[no_scatterer]] = 1
+
+        self.fill_structure(phantom, points_x, points_y, scat_gain, sound_speed_map, density_map, config)
 
 
 class Structure3d(object):
@@ -443,11 +564,11 @@ class Structure3d(object):
         """
 
         # x: cols, y:rows, z:depth
-        for point in self.origins:
-            if ((point.x < 0 or point.x > num_of_cols - 1) or
-               (point.y < 0 or point.y > num_of_rows - 1)  or
-               (point.z < 0 or point.z > num_of_z - 1)):
-                return "The defined points are out of bounds of the phantom.\r\n"
+        points_xyz = np.asarray([(point.x, point.y, point.z) for point in self.origins]).reshape(-1, 3)
+        upper_limits = np.array([num_of_cols - 1, num_of_rows - 1, num_of_z - 1])
+
+        if np.any((points_xyz < 0) | (points_xyz > upper_limits)):
+            return "The defined points are out of bounds of the phantom.\r\n"
 
         return ""
 
@@ -471,6 +592,31 @@ class Sphere(Structure, Structure3d):
         ## Radius of the sphere
         self.radius = args[0]
 
+    @staticmethod
+    def validate_batch(centers_xyz, radii, num_of_rows, num_of_cols, num_of_z):
+        """!
+        \brief Validates the configuration of several spheres at once
+
+        \param centers_xyz Coordinates (x, y, z) of the center of each sphere
+        \param radii Radius of each sphere
+        \param num_of_rows Number of rows in the phantom
+        \param num_of_cols Number of columns in the phantom
+        \param num_of_z Number of slices in the phantom
+
+        \return An empty string if the spheres configuration is valid; an error string per invalid sphere otherwise
+        """
+
+        centers_xyz = np.asarray(centers_xyz).reshape(-1, 3)
+        radii = np.asarray(radii)
+
+        invalid_radius = radii <= 0
+        upper_limits = np.array([num_of_cols - 1, num_of_rows - 1, num_of_z - 1])
+        out_of_bounds = ~invalid_radius & (np.any(centers_xyz + radii[:, np.newaxis] > upper_limits, axis=1) |
+                                           np.any(centers_xyz < radii[:, np.newaxis], axis=1))
+
+        return batch_errors(invalid_radius, out_of_bounds, "Sphere radius must be greater than zero",
+                            "The defined sphere is out of bounds of the phantom.\r\n")
+
     def validate(self, num_of_rows, num_of_cols, num_of_z):
         """!
         \brief Validates the sphere configuration
@@ -482,13 +628,7 @@ class Sphere(Structure, Structure3d):
         \return An empty string if the sphere configuration is valid; an error string otherwise
         """
 
-        if (self.radius <= 0):
-            return "Sphere radius must be greater than zero"
-        elif ((self.center.y + self.radius > num_of_rows - 1) or (self.center.x + self.radius > num_of_cols - 1)  or (self.center.z + self.radius > num_of_z - 1) or
-           (self.center.x < self.radius) or (self.center.y < self.radius) or (self.center.z < self.radius)):
-           return "The defined sphere is out of bounds of the phantom.\r\n"
-        else:
-            return ""
+        return Sphere.validate_batch([(self.center.x, self.center.y, self.center.z)], [self.radius], num_of_rows, num_of_cols, num_of_z)
 
     def fill_volume(self, phantom, slice, sound_speed_map, density_map, scat_gain, config):
         """!
@@ -502,13 +642,16 @@ class Sphere(Structure, Structure3d):
         \param config The parsed configuration
         """
 
-        # Create a cube and, inside it, search for points that are inside the sphere
+        # The sphere does not cross slices farther than its radius from the center
+        remaining_radius_sq = self.radius**2 - (slice - self.center.z)**2
+        if remaining_radius_sq < 0:
+            return
+
+        # Create a square and, inside it, search for points of the slice that are inside the sphere
         top_x = self.center.x - self.radius
         top_y = self.center.y - self.radius
 
-        for x in range(top_x, top_x + 2*self.radius):
-            if mod(x, 10) == 0:
-                ut.log_message("Filling column " + str(x) + ". Range from " + str(top_x) + " to " + str(top_x + 2*self.radius), config.get("verbose", False))
-            for y in range(top_y, top_y + 2*self.radius):
-                if pow((x - self.center.x), 2) + pow((y - self.center.y), 2) + pow((slice - self.center.z), 2) <= pow(self.radius, 2):
-                    self.fill_structure(phantom, x, y, scat_gain, sound_speed_map, density_map, config)
+        x, y = np.ogrid[top_x:top_x + 2*self.radius, top_y:top_y + 2*self.radius]
+        inside_x, inside_y = np.nonzero((x - self.center.x)**2 + (y - self.center.y)**2 <= remaining_radius_sq)
+
+        self.fill_structure(phantom, top_x + inside_x, top_y + inside_y, scat_gain, sound_speed_map, density_map, config)
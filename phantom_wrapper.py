@@ -4,11 +4,11 @@
 \brief Wrapper for the high level phantom operations
 """
 
+import copy
+import functools
 import os
-import json
-
-import matplotlib.image as mpimg
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pathlib import Path
 
 import mx_us_phantom.phantom as ph
 import mx_us_phantom.config_validation as cfg_val
@@ -31,16 +31,15 @@ class PhantomWrapper():
         """
         self.args = args
 
-        ut.log_message("Parsing configuration from " + args.config)
+        ut.log("Parsing configuration from %s", args.config)
 
         self.configuration = self.parse_config()
 
         output_name = self.get_output_name()
-        ut.log_message("Output name: " + output_name)
-        output_path = os.path.dirname(args.config)
-        self.output_path_prefix = os.path.normpath(os.path.join(output_path, output_name))
+        ut.log("Output name: %s", output_name)
+        self.output_path_prefix = str(Path(args.config).parent / output_name)
 
-        ut.log_message("Generating phantom \"" + output_name + "\"")
+        ut.log("Generating phantom \"%s\"", output_name)
 
 
     def get_output_name(self):
@@ -51,7 +50,7 @@ class PhantomWrapper():
         """
 
         if not self.args.output_name:
-            output_name = os.path.basename(self.args.config).split('.json')[0]
+            output_name = Path(self.args.config).stem
         else:
             output_name = self.args.output_name
 
@@ -67,8 +66,8 @@ class PhantomWrapper():
         \return The configuration parsed from the input file
         """
 
-        with open(self.args.config) as json_file:
-            configuration = json.load(json_file)
+        # The cached configuration is shared, so each wrapper gets its own copy
+        configuration = copy.deepcopy(_load_and_validate(self.args.config, os.path.getmtime(self.args.config)))
 
         # Parse verbosity and add to configuration
         if  not self.args.verbosity:
@@ -82,11 +81,8 @@ class PhantomWrapper():
         verbosity = {"verbose": verbose}
         configuration.update(verbosity)
 
-        print(configuration)
-
-        validation_error = cfg_val.validate_configuration(configuration)
-        if validation_error:
-            raise Exception(validation_error)
+        ut.log("Loaded configuration with %d parameters and %d structures", len(configuration),
+               len(configuration.get("structures", [])), verbose=verbose)
 
         return configuration
 
@@ -130,22 +126,35 @@ class PhantomWrapper():
 
         num_of_z = self.configuration.get("depth_z", 1)
 
-        verbose = self.configuration.get("verbose", False)
+        # The mat files of 3-D phantoms store the whole volume, so only the other formats are saved per slice
+        if (num_of_z == 1):
+            slice_format = self.args.format
+        else:
+            slice_format = self.args.format.replace('m', '')
 
-        for slice_z in range(num_of_z):
-            if (num_of_z == 1):
-                postfix = ""
-            else:
-                postfix = "_slice_" + str(slice_z)
+        phantom = ph.Phantom(self.configuration)
+
+        # Saving is I/O bound, so each slice is saved in the background while the next ones are generated
+        with ThreadPoolExecutor(max_workers=2) as io_pool:
+            saves = []
+
+            def save_slice(slice_z):
+                if (num_of_z == 1):
+                    postfix = ""
+                else:
+                    postfix = "_slice_" + str(slice_z)
+
+                saves.append(io_pool.submit(phantom.save_all, slice_format, self.output_path_prefix + postfix, slice_z))
 
-            ut.log_message("Generating slice " + str(slice_z), verbose)
-            phantom = ph.Phantom()
-            phantom.generate_phantom_matrix(self.configuration, slice_z)
+            phantom.generate_phantom_volume(self.args.jobs, save_slice)
 
-            phantom.save_all(self.args.format, self.output_path_prefix + postfix)
+            for save in saves:
+                # Raises the exception if saving failed
+                save.result()
 
-        ut.log_message("Generating final output file")
-        phantom.generate_final_output(self.configuration, self.output_path_prefix)
+        if 'm' in self.args.format:
+            ut.log_message("Generating final output file")
+            phantom.generate_final_output(self.output_path_prefix)
 
 
     def gen_image_based_phantom(self, name_path_prefix, input_image):
@@ -156,9 +165,7 @@ class PhantomWrapper():
         \param input_image The image file used as reference to generate the phantom
         """
 
-        phantom = ph.Phantom()
-        phantom.generate_phantom_from_image(self.configuration, input_image)
-        phantom.save_all(self.args.format, name_path_prefix)
+        _gen_image_based_phantom(self.configuration, self.args.format, name_path_prefix, input_image)
 
 
     def gen_phantoms_from_directory(self):
@@ -169,11 +176,24 @@ class PhantomWrapper():
         if not os.path.exists(self.output_path_prefix):
             os.makedirs(self.output_path_prefix)
 
-        for entry in os.scandir(self.configuration["image_path"]):
-            if os.path.isfile(entry.path):
+        output_dir = Path(self.output_path_prefix)
+
+        # The type of the entries is cached by scandir, so no extra stat() is needed per file
+        images = []
+        with os.scandir(self.configuration["image_path"]) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    output = str(output_dir / Path(entry.name).stem)
+                    images.append((output, entry.path))
+
+        # The phantoms are independent, so each image is processed in a separate process
+        with ProcessPoolExecutor(max_workers=self.args.jobs) as executor:
+            phantoms = [executor.submit(_gen_image_based_phantom, self.configuration, self.args.format, output, input_image)
+                        for output, input_image in images]
+
+            for phantom in as_completed(phantoms):
                 try:
-                    output = os.path.normpath(os.path.join(self.output_path_prefix, os.path.basename(entry.path.rsplit('.', 1)[0])))
-                    self.gen_image_based_phantom(output, entry.path)
+                    phantom.result()
                 except Exception as e:
                     print(e)
 
@@ -192,9 +212,50 @@ class PhantomWrapper():
 
         if phantom_format == "k_wave" and 'm' in self.args.format:
             plot_cmd = 'python plot_3d_phantom.py -a phantom -f ' + self.output_path_prefix + ".mat" + ' -m light'
-            ut.log_message("You can now visualize the phantom by running \'" + plot_cmd + "\'")
+            ut.log("You can now visualize the phantom by running \'%s\'", plot_cmd)
         elif phantom_format == "effec_scatterers" and 'p' in self.args.format:
+            # Imported only here, so the GUI backend is not loaded when nothing is displayed
+            import matplotlib.image as mpimg
+            import matplotlib.pyplot as plt
+
             img = mpimg.imread(self.output_path_prefix + ".png")
             plt.imshow(img)
             plt.title(self.output_path_prefix + ".png")
             plt.show()
+
+
+def _gen_image_based_phantom(configuration, output_format, name_path_prefix, input_image):
+    """!
+    \brief Generates and saves a phantom from an input image. Defined at module level so it can run in other processes
+
+    \param configuration The parsed and validated configuration
+    \param output_format Format to save the phantom ('t' - txt, 'm' - mat or 'p' - png)
+    \param name_path_prefix Path + prefix of the output file name
+    \param input_image The image file used as reference to generate the phantom
+    """
+
+    phantom = ph.Phantom(configuration)
+    phantom.generate_phantom_from_image(input_image)
+    phantom.save_all(output_format, name_path_prefix)
+
+
+@functools.lru_cache(maxsize=32)
+def _load_and_validate(config_path, mtime):
+    """!
+    \brief Parses and validates a json configuration. The result is cached while the file is not modified
+
+    \param config_path Path of the json configuration file
+    \param mtime Modification time of the file, so a modified file is parsed again
+
+    \note Raises an exception if an error is found
+
+    \return The configuration parsed from the input file (must not be modified)
+    """
+
+    configuration = ut.load_json(config_path)
+
+    validation_error = cfg_val.validate_configuration(configuration)
+    if validation_error:
+        raise Exception(validation_error)
+
+    return configuration
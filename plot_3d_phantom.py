@@ -1,7 +1,7 @@
 """!
 \file plot_3d_phantom.py
 
-\brief Displays the 3-D phantom and save an svg with a 2-D view
+\brief Displays the 3-D phantom and save a png with a 2-D view
 """
 
 import sys
@@ -14,6 +14,9 @@ import scipy.io
 
 import utils as ut
 
+## Number of voxels above which the volume is automatically downsampled before rendering
+MAX_RENDERED_VOXELS = 64**3
+
 
 def get_example_text():
     """!
@@ -37,20 +40,21 @@ def parse_arguments():
 
     example_text = get_example_text()
 
-    description_text = 'Plot the 3-D phantom from the .mat file generated with generate phantom utility. An svg file named with array name and the timestamp is also generated'
+    description_text = 'Plot the 3-D phantom from the .mat file generated with generate phantom utility. A png file named with array name and the timestamp is also generated'
     parser = argparse.ArgumentParser(description=description_text, epilog=example_text, formatter_class=argparse.RawDescriptionHelpFormatter)
     required_named = parser.add_argument_group('Required named arguments')
     required_named.add_argument('-a', '--array_name', help="The internal array name stored in the .mat file", required=True)
     required_named.add_argument('-f', '--file_name', help='Path of the 3-D mat file containing the phantom data', required=True)
     optional_args = parser.add_argument_group('Optional arguments')
     optional_args.add_argument('-m', '--color_mode', help="Options are 'light' and 'dark', without quotes", required=False)
+    optional_args.add_argument('-d', '--downsample', help="Only every n-th voxel in each direction is rendered (1 renders all of them). Default: chosen so that at most 64^3 voxels are rendered", type=int, required=False)
 
     return parser.parse_args()
 
 
 def plot_and_save(args):
     """!
-    \brief Plots the 3-D data and save a 2-D view as svg file
+    \brief Plots the 3-D data and save a 2-D view as png file
 
     \param args The parsed arguments
     """
@@ -62,10 +66,26 @@ def plot_and_save(args):
 
     array_name = args.array_name
 
-    data = scipy.io.loadmat(args.file_name)
+    # Only the requested array is decoded
+    data = scipy.io.loadmat(args.file_name, variable_names=[array_name])
     volume = data[array_name].transpose(1, 0, 2)
-    max_value = np.max(np.max(np.max(np.abs(volume))))
-    data_v = pv.wrap(255*np.abs(volume)/max_value) # The data is of complex type, so needs the abs()
+
+    # Large volumes are rendered with a stride, so the rendering stays interactive
+    if args.downsample:
+        stride = args.downsample
+    else:
+        stride = max(1, int(np.ceil((volume.size/MAX_RENDERED_VOXELS) ** (1/3))))
+
+    if stride > 1:
+        print("Rendering one of every " + str(stride) + " voxels in each direction")
+        volume = volume[::stride, ::stride, ::stride]
+
+    # The data is of complex type, so needs the abs(). It is computed once and normalized in place
+    volume = np.abs(volume).astype(np.float32, copy=False)
+    max_value = volume.max()
+    if max_value > 0:
+        volume *= 255/max_value
+    data_v = pv.wrap(volume)
 
     pl = pv.Plotter()
     if color_mode == 'dark':
@@ -77,10 +97,10 @@ def plot_and_save(args):
 
     pl.add_volume(data_v, cmap='viridis')
     pl.add_bounding_box()
-    image_name = array_name + "_" + ut.current_time_for_filename() + ".svg"
-    pl.save_graphic(image_name)
-    print("Saved screenshot to " + image_name)
-    pl.show()
+    # A raster screenshot of the initial view, much faster to write than a vector (svg) export of a volume
+    image_name = array_name + "_" + ut.current_time_for_filename() + ".png"
+    print("Saving screenshot to " + image_name)
+    pl.show(screenshot=image_name)
 
 
 def main():
@@ -98,6 +118,10 @@ def main():
         print("File \"" + file_name + "\" not found. Exiting")
         sys.exit(-1)
 
+    if args.downsample is not None and args.downsample < 1:
+        print("Downsample factor should be >= 1. Exiting")
+        sys.exit(-1)
+
     plot_and_save(args)
 
 if __name__ == "__main__":
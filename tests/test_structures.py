@@ -4,6 +4,7 @@ Run tests with 'python -m unittest tests.test_structures'
 """
 
 from mx_us_phantom import structures as struc
+import numpy as np
 import unittest
 
 
@@ -350,13 +351,38 @@ class TestStructuresValidation(unittest.TestCase):
 
         self.assertFalse(not validation_error)
 
+    def test_batch_validation__one_error_per_invalid_structure(self):
+        """
+        Test that validating several structures at once reports each invalid structure
+        """
+
+        validation_error = struc.Circle.validate_batch([(10, 20), (0, 0), (30, 30)], [10, 10, 0], 64, 128)
+
+        self.assertEqual(validation_error.count("out of bounds"), 1)
+        self.assertEqual(validation_error.count("greater than zero"), 1)
+
+        # Same messages, in the same order, as validating the circles one by one
+        validation_error = struc.Circle.validate_batch([(0, 0), (30, 30), (10, 20)], [10, 0, 10], 64, 128)
+
+        self.assertEqual(validation_error, "The defined circle is out of bounds of the phantom.\r\n" + "Circle radius must be greater than zero")
+
+        validation_error = struc.SinglePoint.validate_batch([(0, 0), (-1, 0), (600, 600), (1, 1)], [2, 1, 1], 512, 512)
+
+        self.assertEqual(validation_error.count("out of bounds"), 2)
+
+        validation_error = struc.Polygon.validate_batch([], [], 512, 512)
+
+        self.assertTrue(not validation_error)
+
 
 class CheckFilledArea(unittest.TestCase):
     """
     Verify that the area of the structure is correctly filled
     """
-    def setUp(self):
-        self.configuration = {
+    @classmethod
+    def setUpClass(cls):
+        # The configuration is only read by the tests, so it is shared by all of them
+        cls.configuration = {
             "rows_y":512,
             "cols_x":512,
             "distribution":"rayleigh",
@@ -370,11 +396,15 @@ class CheckFilledArea(unittest.TestCase):
             ]
         }
 
-        self.num_of_rows = 20
-        self.num_of_cols = 20
-        self.phantom = [[1 for y in range(self.num_of_rows)] for x in range(self.num_of_cols)]
-        self.sound_speed_map = [[1 for y in range(self.num_of_rows)] for x in range(self.num_of_cols)]
-        self.density_map = [[1 for y in range(self.num_of_rows)] for x in range(self.num_of_cols)]
+        cls.num_of_rows = 20
+        cls.num_of_cols = 20
+        cls.pristine = np.ones((cls.num_of_cols, cls.num_of_rows), dtype=np.int32)
+
+    def setUp(self):
+        # Each test fills its own copy of the pristine arrays
+        self.phantom = self.pristine.copy()
+        self.sound_speed_map = self.pristine.copy()
+        self.density_map = self.pristine.copy()
 
     def test_fill_SinglePoint__only_specified_points_filled(self):
         """
@@ -393,16 +423,28 @@ class CheckFilledArea(unittest.TestCase):
         for i in range(len(ix)):
             points[i].fill_area(self.phantom, self.sound_speed_map, self.density_map, gain[i], self.configuration)
 
-        num_of_filled_points = 0
+        # The phantom was filled with ones, so only the specified points are multiplied by their gain
+        expected = np.ones_like(self.phantom)
+        expected[ix, iy] = gain
 
-        for x in range(self.num_of_cols):
-            for y in range(self.num_of_rows):
-                for i in range(len(ix)):
-                    if (x == ix[i] and y == iy[i]):
-                        if (self.phantom[x][y] == gain[i]):
-                            num_of_filled_points = num_of_filled_points + 1
+        self.assertTrue(np.array_equal(self.phantom, expected))
+
+    def test_fill_SinglePoint_set__only_specified_points_filled(self):
+        """
+        Check that a set of points is filled at once, with one gain per point
+        """
+
+        ix = np.array([0, 1, 1, 1, 3])
+        iy = np.array([0, 0, 1, 2, 2])
+        gain = np.array([4, 9, 3, 5, 6])
+
+        points = struc.SinglePoint([struc.Point((x, y)) for x, y in zip(ix, iy)])
+        points.fill_area(self.phantom, self.sound_speed_map, self.density_map, gain, self.configuration)
+
+        expected = np.ones_like(self.phantom)
+        expected[ix, iy] = gain
 
-        self.assertTrue(num_of_filled_points == len(ix))
+        self.assertTrue(np.array_equal(self.phantom, expected))
 
     def test_fill_triangle__only_specified_points_filled(self):
         """
@@ -414,15 +456,29 @@ class CheckFilledArea(unittest.TestCase):
         gain = 7
         triangle.fill_area(self.phantom, self.sound_speed_map, self.density_map, gain, self.configuration)
 
-        num_of_filled_points = 0
+        num_of_filled_points = np.count_nonzero(self.phantom == gain)
 
-        for y in range(self.num_of_rows):
-            for x in range(self.num_of_cols):
-                if (self.phantom[x][y] == gain):
-                    num_of_filled_points = num_of_filled_points + 1
-        
         self.assertTrue(num_of_filled_points == 12) # Magic number based on previous tests
 
+    def test_fill_concave_polygon__same_points_as_in_polygon(self):
+        """
+        Check that the filled points are the points found inside the polygon one by one
+        """
+
+        vertices = [struc.Point(p) for p in [(2, 1), (17, 3), (9, 8), (15, 17), (1, 14)]]
+        polygon = struc.Polygon(vertices)
+
+        gain = 7
+        polygon.fill_area(self.phantom, self.sound_speed_map, self.density_map, gain, self.configuration)
+
+        expected = np.ones_like(self.phantom)
+        for x in range(self.num_of_cols):
+            for y in range(self.num_of_rows):
+                if struc.Point((x, y)).in_polygon(vertices):
+                    expected[x, y] = gain
+
+        self.assertTrue(np.array_equal(self.phantom, expected))
+
     def test_fill_rectangle__only_specified_points_filled(self):
         """
         Check that a few points are filled inside a rectangle
@@ -433,13 +489,8 @@ class CheckFilledArea(unittest.TestCase):
         gain = 7
         rectangle.fill_area(self.phantom, self.sound_speed_map, self.density_map, gain, self.configuration)
 
-        num_of_filled_points = 0
+        num_of_filled_points = np.count_nonzero(self.phantom == gain)
 
-        for y in range(self.num_of_rows):
-            for x in range(self.num_of_cols):
-                if (self.phantom[x][y] == gain):
-                    num_of_filled_points = num_of_filled_points + 1
-        
         self.assertTrue(num_of_filled_points == 12) # Magic number based on previous tests
 
     def test_fill_circle__only_specified_points_filled(self):
@@ -452,15 +503,25 @@ class CheckFilledArea(unittest.TestCase):
         gain = 7
         circle.fill_area(self.phantom, self.sound_speed_map, self.density_map, gain, self.configuration)
 
-        num_of_filled_points = 0
-
-        for y in range(self.num_of_rows):
-            for x in range(self.num_of_cols):
-                if (self.phantom[x][y] == gain):
-                    num_of_filled_points = num_of_filled_points + 1
+        num_of_filled_points = np.count_nonzero(self.phantom == gain)
 
         self.assertTrue(num_of_filled_points == 79) # Magic number based on previous tests
 
+    def test_fill_circle_at_border__no_points_wrapped(self):
+        """
+        Check that a circle crossing the border of the phantom is not wrapped to the other side
+        """
+
+        circle = struc.Circle([struc.Point((1, 2))], 5)
+
+        gain = 7
+        circle.fill_area(self.phantom, self.sound_speed_map, self.density_map, gain, self.configuration)
+
+        x, y = np.nonzero(self.phantom == gain)
+
+        self.assertTrue(np.all((x - 1)**2 + (y - 2)**2 <= 25))
+        self.assertTrue(np.count_nonzero(self.phantom == gain) > 0)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -4,164 +4,164 @@ Run tests with 'python -m unittest tests.test_validation'
 """
 
 from mx_us_phantom import config_validation as cfg_val
+from types import MappingProxyType
+import re
 import unittest
+from unittest import mock
+
+## Structures of the valid base configuration (read-only). The test configurations are converted to dicts and lists before being validated
+_BASE_STRUCTURES = (
+    MappingProxyType({ "type":"circle", "center_xy":( 20, 30 ), "radius":10, "scat_gain":3 }),
+    MappingProxyType({ "type":"rectangle", "top_left_corner_xy":( 50, 60 ), "length_x":20, "length_y":30, "scat_gain":4 }),
+    MappingProxyType({ "type":"free_polygon", "vertices_xy":( (200, 200), (400, 200), (400, 400) ), "scat_gain":1 }),
+    MappingProxyType({ "type":"points", "coordinates_xy":( (80, 90), (85, 85) ), "scat_gain":2 })
+)
+
+## Valid base configuration (read-only), the test configurations are built by replacing some of its parameters
+_BASE_CONFIGURATION = MappingProxyType({
+    "rows_y":512,
+    "cols_x":512,
+    "distribution":"rayleigh",
+    "perc_of_scatterers":50,
+    "phantom_format":"effec_scatterers",
+    "structures":_BASE_STRUCTURES
+})
+
+
+def _thaw(configuration):
+    """
+    Converts a test configuration (read-only mappings and tuples) to dicts and lists, as parsed from a configuration file
+    """
+    if isinstance(configuration, (MappingProxyType, dict)):
+        return {key: _thaw(value) for key, value in configuration.items()}
+
+    if isinstance(configuration, (tuple, list)):
+        return [_thaw(value) for value in configuration]
+
+    return configuration
 
 
 class TestConfigValidation(unittest.TestCase):
     """
     Verify that configuration validation is properly done
     """
-    def test_valid_config__no_errors(self):
+    @classmethod
+    def setUpClass(cls):
+        all_structures = (*_BASE_STRUCTURES[:2], {**_BASE_STRUCTURES[2], "scat_gain":0}, _BASE_STRUCTURES[3])
+
+        # Test cases: description, configuration, expected error fragments (none if valid) and if an exception is raised
+        cls.cases = [
+            ("valid configuration", cls.variant(), (), False),
+            ("empty configuration", {},
+             ("One of more parameters is missing in the configuration file", "\"rows_y\" is missing", "\"cols_x\" is missing",
+              "\"distribution\" is missing", "\"perc_of_scatterers\" is missing", "\"phantom_format\" is missing"), True),
+            ("invalid distribution and scatterers percentage",
+             cls.variant(distribution="gamma", perc_of_scatterers=-50, structures=_BASE_STRUCTURES[:2]),
+             ("Supported distributions are", "Percentage of scatterers should be"), False),
+            ("non-supported structure",
+             cls.variant(distribution="gamma", perc_of_scatterers=-50, structures=[
+                 { "type":"square", "top_left_corner_xy":[ 50, 60 ], "length_x":20, "length_y":30, "scat_gain":4 }
+             ]),
+             ("The structure of type", "Supported structures are"), False),
+            ("all supported structures", cls.variant(structures=all_structures), (), False),
+            ("k-Wave parameters missing", cls.variant(phantom_format="k_wave"),
+             ("One of more parameters is missing in the configuration file", "\"sound_speed_c0_m_per_s\" is missing",
+              "\"density_rho0_kg_per_m3\" is missing"), True),
+            ("3-D effec_scatterers phantom", cls.variant(depth_z=5), ("effec_scatterers only supports 2-D phantoms",), False),
+            ("missing and invalid structure parameters",
+             cls.variant(structures=[
+                 { "type":"circle", "center_xy":[ 20, 30 ], "scat_gain":3 },
+                 { "type":"rectangle", "top_left_corner_xy":[ 50, 60 ], "length_x":20, "length_y":30, "scat_gain":-4 }
+             ]),
+             ("Structure circle: parameter \"radius\" is missing",
+              "Structure rectangle: relative amplitude of the scatterers should be >= 0"), False),
+            ("upper case values",
+             cls.variant(distribution="Rayleigh", phantom_format="EFFEC_SCATTERERS", structures=[
+                 { "type":"Circle", "center_xy":[ 20, 30 ], "radius":10, "scat_gain":3 }
+             ]), (), False),
+            ("unknown parameters",
+             cls.variant(scat_gain=2, structures=[
+                 { "type":"circle", "center_xy":[ 20, 30 ], "radius":10, "radius_y":5, "scat_gain":3 }
+             ]),
+             ("'scat_gain' was unexpected", "Structure circle:", "'radius_y' was unexpected"), False)
+        ]
+
+    @classmethod
+    def variant(cls, **parameters):
         """
-        Test with a valid configuration
+        Base configuration with some parameters replaced
         """
-        configuration = {
-            "rows_y":512,
-            "cols_x":512,
-            "distribution":"rayleigh",
-            "perc_of_scatterers":50,
-            "phantom_format":"effec_scatterers",
-            "structures": [
-                { "type":"circle", "center_xy":[ 20, 30 ], "radius":10, "scat_gain":3 },
-                { "type":"rectangle", "top_left_corner_xy":[ 50, 60 ], "length_x":20, "length_y":30, "scat_gain":4 },
-                { "type":"free_polygon", "vertices_xy":[ [200, 200], [400, 200], [400, 400] ], "scat_gain":1 },
-                { "type":"points", "coordinates_xy":[ [80, 90], [85, 85] ], "scat_gain":2 }
-            ]
-        } 
-        
-        validation_error = cfg_val.validate_configuration(configuration)
-        
-        self.assertEqual(validation_error, "")
+        return {**_BASE_CONFIGURATION, **parameters}
 
-    def test_parameters_missing__errors_detected(self):
+    def test_configurations__expected_errors_detected(self):
         """
-        Test with empty configuration
+        Validate each test configuration and check that only the expected errors are found
         """
-        configuration = { }
+        for description, configuration, expected, raises in self.cases:
+            with self.subTest(description):
+                configuration = _thaw(configuration)
 
-        with self.assertRaises(Exception) as context:
-            cfg_val.validate_configuration(configuration)
+                if raises:
+                    with self.assertRaises(Exception) as context:
+                        cfg_val.validate_configuration(configuration)
 
-        self.assertTrue("One of more parameters is missing in the configuration file" in str(context.exception))
-        self.assertTrue("\"rows_y\" is missing" in str(context.exception))
-        self.assertTrue("\"cols_x\" is missing" in str(context.exception))
-        self.assertTrue("\"distribution\" is missing" in str(context.exception))
-        self.assertTrue("\"perc_of_scatterers\" is missing" in str(context.exception))
-        self.assertTrue("\"phantom_format\" is missing" in str(context.exception))
+                    error_msg = str(context.exception)
+                else:
+                    error_msg = cfg_val.validate_configuration(configuration)
 
-    def test_invalid_single_parameters__errors_detected(self):
-        """
-        Test with invalid parameters: distribution and scatterers percentage
-        """
-        configuration = {
-            "rows_y":512,
-            "cols_x":512,
-            "distribution":"gamma",
-            "perc_of_scatterers":-50,
-            "phantom_format":"effec_scatterers",
-            "structures": [
-                { "type":"circle", "center_xy":[ 20, 30 ], "radius":10, "scat_gain":3 },
-                { "type":"rectangle", "top_left_corner_xy":[ 50, 60 ], "length_x":20, "length_y":30, "scat_gain":4 }
-            ]
-        } 
-        
-        validation_error = cfg_val.validate_configuration(configuration)
-        
-        self.assertNotEqual(validation_error, "")
-        self.assertIn("Supported distributions are", validation_error)
-        self.assertIn("Percentage of scatterers should be", validation_error)
-
-    def test_invalid_structure_define__errors_detected(self):
+                if not expected:
+                    self.assertEqual(error_msg, "")
+                else:
+                    # One lookahead per fragment, so the message is checked with a single regex
+                    pattern = re.compile("".join("(?=.*" + re.escape(text) + ")" for text in expected), re.S)
+                    self.assertRegex(error_msg, pattern)
+
+    def test_structure_parameters_missing__valid_parameters_not_unknown(self):
         """
-        Test that a non-supported structure is detected
+        Test that the valid parameters of a structure with missing parameters are not reported as unknown
         """
-        configuration = {
-            "rows_y":512,
-            "cols_x":512,
-            "distribution":"gamma",
-            "perc_of_scatterers":-50,
-            "phantom_format":"effec_scatterers",
-            "structures": [
-                { "type":"square", "top_left_corner_xy":[ 50, 60 ], "length_x":20, "length_y":30, "scat_gain":4 }
-            ]
-        } 
-        
-        validation_error = cfg_val.validate_configuration(configuration)
-        
-        self.assertNotEqual(validation_error, "")
-        self.assertIn("The structure of type", validation_error)
-        self.assertIn("Supported structures are", validation_error)
-
-    def test_valid_structures_only__no_errors(self):
+        configuration = self.variant(structures=[{ "type":"circle", "center_xy":[ 20, 30 ], "scat_gain":3 }])
+
+        validation_error = cfg_val.validate_configuration(_thaw(configuration))
+
+        self.assertIn("Structure circle: parameter \"radius\" is missing", validation_error)
+        self.assertNotIn("'center_xy' was unexpected", validation_error)
+
+    @unittest.skipIf(cfg_val.fastjsonschema is None, "fastjsonschema is not installed")
+    def test_many_valid_structures__detailed_schema_pass_skipped(self):
         """
-        Test that all supported structures are accepted
+        Test that a valid configuration is accepted without the detailed (jsonschema) pass, used only to build the messages
         """
-        configuration = {
-            "rows_y":512,
-            "cols_x":512,
-            "distribution":"rayleigh",
-            "perc_of_scatterers":50,
-            "phantom_format":"effec_scatterers",
-            "structures": [
-                { "type":"circle", "center_xy":[ 20, 30 ], "radius":10, "scat_gain":3 },
-                { "type":"rectangle", "top_left_corner_xy":[ 50, 60 ], "length_x":20, "length_y":30, "scat_gain":4 },
-                { "type":"free_polygon", "vertices_xy":[ [200, 200], [400, 200], [400, 400] ], "scat_gain":0 },
-                { "type":"points", "coordinates_xy":[ [80, 90], [85, 85] ], "scat_gain":2 }
-            ]
-        } 
-        
-        validation_error = cfg_val.validate_configuration(configuration)
-        
+        configuration = _thaw(self.variant(structures=_BASE_STRUCTURES * 250))
+
+        with mock.patch.object(cfg_val, "_VALIDATOR", wraps=cfg_val._VALIDATOR) as validator:
+            validation_error = cfg_val.validate_configuration(configuration)
+
         self.assertEqual(validation_error, "")
+        validator.iter_errors.assert_not_called()
 
-    def test_k_wave_parameters_missing__errors_detected(self):
+    def test_invalid_configuration__detailed_schema_errors(self):
         """
-        Test that all supported structures are accepted
+        Test that an invalid configuration is still reported with the messages of the detailed (jsonschema) pass
         """
-        configuration = {
-            "rows_y":512,
-            "cols_x":512,
-            "distribution":"rayleigh",
-            "perc_of_scatterers":50,
-            "phantom_format":"k_wave",
-            "structures": [
-                { "type":"circle", "center_xy":[ 20, 30 ], "radius":10, "scat_gain":3 },
-                { "type":"rectangle", "top_left_corner_xy":[ 50, 60 ], "length_x":20, "length_y":30, "scat_gain":4 },
-                { "type":"free_polygon", "vertices_xy":[ [200, 200], [400, 200], [400, 400] ], "scat_gain":0 },
-                { "type":"points", "coordinates_xy":[ [80, 90], [85, 85] ], "scat_gain":2 }
-            ]
-        } 
-
-        with self.assertRaises(Exception) as context:
-            cfg_val.validate_configuration(configuration)
-
-        self.assertTrue("One of more parameters is missing in the configuration file" in str(context.exception))
-        self.assertTrue("\"sound_speed_c0_m_per_s\" is missing" in str(context.exception))
-        self.assertTrue("\"density_rho0_kg_per_m3\" is missing" in str(context.exception))
-
-    def test_3d_effec_scatterers__not_accepted(self):
+        configuration = _thaw(self.variant(scat_gain=2))
+
+        with mock.patch.object(cfg_val, "_VALIDATOR", wraps=cfg_val._VALIDATOR) as validator:
+            validation_error = cfg_val.validate_configuration(configuration)
+
+        self.assertIn("'scat_gain' was unexpected", validation_error)
+        validator.iter_errors.assert_called_once()
+
+    def test_valid_configuration__not_modified(self):
         """
-        Test that all supported structures are accepted
+        Test that validation does not modify the configuration, as the test configurations share the base structures
         """
-        configuration = {
-            "rows_y":512,
-            "cols_x":512,
-            "depth_z":5,
-            "distribution":"rayleigh",
-            "perc_of_scatterers":50,
-            "phantom_format":"effec_scatterers",
-            "structures": [
-                { "type":"circle", "center_xy":[ 20, 30 ], "radius":10, "scat_gain":3 },
-                { "type":"rectangle", "top_left_corner_xy":[ 50, 60 ], "length_x":20, "length_y":30, "scat_gain":4 },
-                { "type":"free_polygon", "vertices_xy":[ [200, 200], [400, 200], [400, 400] ], "scat_gain":0 },
-                { "type":"points", "coordinates_xy":[ [80, 90], [85, 85] ], "scat_gain":2 }
-            ]
-        } 
-        
-        validation_error = cfg_val.validate_configuration(configuration)
-        
-        self.assertNotEqual(validation_error, "")
-        self.assertIn("effec_scatterers only supports 2-D phantoms", validation_error)
+        configuration = _thaw(self.variant(distribution="Rayleigh"))
+        expected = _thaw(configuration)
+
+        cfg_val.validate_configuration(configuration)
+
+        self.assertEqual(configuration, expected)
 
 
 if __name__ == '__main__':
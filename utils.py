@@ -4,30 +4,218 @@
 \brief Set of helper functions
 """
 
-import datetime
+import itertools
+import json
+import logging
 import psutil
 import os
+import sys
+import time
 
+try:
+    import orjson
+except ImportError:
+    # Optional, the json module is used if orjson is not installed
+    orjson = None
 
-def log_message(text, verbose = True):
+## Logger of the application messages
+logger = logging.getLogger("mx_us_phantom")
+
+if not logger.handlers:
+    # The messages are printed to the standard output as they are, the timestamp and resources usage are part of the message
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+## Silent messages only sample the memory usage (for the critical usage warning) once every this number of calls
+_MEMORY_SAMPLING_INTERVAL = 32
+
+## Minimum time (s) between two critical resources usage warnings
+_WARNING_INTERVAL_SECONDS = 5.0
+
+## Time (s) above which a probe of the disk is considered slow (e.g. network or FUSE file systems)
+_SLOW_DISK_SECONDS = 0.01
+
+## Format of the timestamps of the log messages
+_LOG_TIME_FORMAT = '%d-%m-%Y %H:%M:%S'
+
+## Last second (epoch) for which a log timestamp was formatted and its formatted timestamp
+_last_log_time = (-1, "")
+
+## Format of the timestamps used in file names
+_FILE_TIME_FORMAT = '%Y-%m-%d_%H-%M-%S'
+
+
+def disk_usage_percent(path):
+    """!
+    \brief Gets the disk usage of the file system of a path, computed as psutil.disk_usage does
+
+    \param path Path in the disk
+
+    \return The used space, in percentage of the space available to the user
+    """
+
+    if not hasattr(os, "statvfs"):
+        # No statvfs (e.g. Windows)
+        return psutil.disk_usage(path).percent
+
+    # The space reserved to root is not counted, only the space available to the user
+    stats = os.statvfs(path)
+    used = (stats.f_blocks - stats.f_bfree) * stats.f_frsize
+    total_user = used + stats.f_bavail * stats.f_frsize
+
+    return round(100.0 * used / total_user, 1) if total_user else 0.0
+
+
+def is_slow_disk(path):
     """!
-    \brief Prints a log message with a timestamp and resources usage
+    \brief Probes the file system of a path, as querying the usage of network or FUSE file systems can block for a long time
+
+    \param path Path in the disk to be probed
+
+    \return True if the file system is slow or can not be queried; False otherwise
+    """
+
+    if not hasattr(os, "statvfs"):
+        # No statvfs (e.g. Windows), psutil queries the disk without it
+        return False
+
+    start = time.monotonic()
+    try:
+        os.statvfs(path)
+    except OSError:
+        return True
+
+    return time.monotonic() - start > _SLOW_DISK_SECONDS
+
+
+class _ResourcesLogger():
+    """!
+    \brief Logs messages with the resources usage. A single instance keeps the state shared by all log messages
+    """
+
+    # Slots, so the attributes used by every message are found without a dictionary lookup
+    __slots__ = ("_virtual_memory", "_disk_usage", "_disk_path", "_skip_disk_usage", "_calls", "_last_warning")
+
+    def __init__(self, disk_path):
+        """!
+        \brief Initializes the logger
+
+        \param disk_path Path where the disk usage is measured
+        """
+
+        ## Function that queries the memory usage
+        self._virtual_memory = psutil.virtual_memory
+
+        ## Function that queries the disk usage (percentage)
+        self._disk_usage = disk_usage_percent
+
+        ## Path where the disk usage is measured
+        self._disk_path = disk_path
+
+        ## True if the disk usage is not reported because the disk is slow; None if the disk was not probed yet
+        self._skip_disk_usage = None
+
+        ## Number of messages logged, used to sample the memory usage of the silent messages
+        self._calls = itertools.count()
+
+        ## Time (monotonic clock) of the last critical resources usage warning; None if no warning was logged
+        self._last_warning = None
+
+    def set_disk_path(self, path):
+        """!
+        \brief Sets the path where the disk usage is measured
+
+        \param path Path in the disk to be monitored
+        """
 
-    \param text Message to be logged
+        self._disk_path = path
+
+        # The new disk is probed again by the next log message
+        self._skip_disk_usage = None
+
+    def log(self, text, args, verbose):
+        """!
+        \brief Logs a message with a timestamp and resources usage
+
+        \param text Message to be logged. If args are given, it is a printf-style format string
+        \param args Values formatted into the message, only when the message is printed
+        \param verbose Only logs messages if set to true
+        """
+
+        # Silent messages return without any system call, except when the memory usage is sampled
+        sample_memory = next(self._calls) % _MEMORY_SAMPLING_INTERVAL == 0
+        if not verbose and not sample_memory:
+            return
+
+        mem_used_perc = self._virtual_memory().percent
+
+        # The message is only formatted if the logger emits it
+        if verbose and logger.isEnabledFor(logging.INFO):
+            if args:
+                text = text % args
+
+            if self._skip_disk_usage is None:
+                self._skip_disk_usage = is_slow_disk(self._disk_path)
+
+            time_now = current_time_for_logging()
+            disk_used_perc = 0.0 if self._skip_disk_usage else self._disk_usage(self._disk_path)
+            logger.info("[%s Mem/disk usage: %0.2f %% / %0.2f %%] %s", time_now, mem_used_perc, disk_used_perc, text)
+
+        if (mem_used_perc > 90):
+            # While the usage is critical every message would warn, so the warning is logged at most once per interval
+            now = time.monotonic()
+            if self._last_warning is None or now - self._last_warning >= _WARNING_INTERVAL_SECONDS:
+                self._last_warning = now
+                logger.warning("WARNING: Critical resources usage")
+
+
+## Logger of the resources usage, the disk usage is measured in the working directory when the application started
+_RESOURCES_LOGGER = _ResourcesLogger(os.getcwd())
+
+
+def log(text, *args, verbose = True):
+    """!
+    \brief Logs a message with a timestamp only, without querying the resources usage (logger "mx_us_phantom")
+
+    \param text Message to be logged. If args are given, it is a printf-style format string
+    \param args Values formatted into the message, only when the message is printed
+    \param verbose Only logs messages if set to true (default)
+    """
+
+    if verbose and logger.isEnabledFor(logging.INFO):
+        if args:
+            text = text % args
+
+        logger.info("[%s] %s", current_time_for_logging(), text)
+
+
+def log_with_resources(text, *args, verbose = True):
+    """!
+    \brief Logs a message with a timestamp and resources usage (logger "mx_us_phantom", printed to the standard output)
+
+    \param text Message to be logged. If args are given, it is a printf-style format string
+    \param args Values formatted into the message, only when the message is printed
     \param verbose Only logs messages if set to true (default)
     """
 
-    time_now = current_time_for_logging()
-    psutil.virtual_memory()
-    dict(psutil.virtual_memory()._asdict())
-    mem_used_perc = psutil.virtual_memory().percent
-    disk_used_perc = psutil.disk_usage(os.getcwd()).percent
-    
-    if (verbose):
-        print("[" + time_now + " Mem/disk usage: " + "%0.2f" %  + mem_used_perc + " % / "  + "%0.2f" %  + disk_used_perc + " %] " + text)
+    _RESOURCES_LOGGER.log(text, args, verbose)
+
 
-    if (mem_used_perc > 90):
-        print("WARNING: Critical resources usage")
+## Former name of log_with_resources, kept for compatibility
+log_message = log_with_resources
+
+
+def set_log_disk_path(path):
+    """!
+    \brief Sets the path where the disk usage of the log messages is measured (e.g. after changing the working directory)
+
+    \param path Path in the disk to be monitored
+    """
+
+    _RESOURCES_LOGGER.set_disk_path(os.fspath(path))
 
 
 def current_time_for_logging():
@@ -37,9 +225,17 @@ def current_time_for_logging():
     \return Time with format dd-mm-yyyy hh:mm:ss
     """
 
-    now = datetime.datetime.now()
+    global _last_log_time
+
+    # The timestamp only changes once per second, so it is formatted again only when the second changes
+    now = int(time.time())
+    second, time_now = _last_log_time
+    if now != second:
+        # time.strftime formats the local time directly, without creating a datetime object
+        time_now = time.strftime(_LOG_TIME_FORMAT, time.localtime(now))
+        _last_log_time = (now, time_now)
 
-    return now.strftime('%d-%m-%Y %H:%M:%S')
+    return time_now
 
 
 def current_time_for_filename():
@@ -49,6 +245,21 @@ def current_time_for_filename():
     \return Time with format yyyy-mm-dd_hh-mm-ss
     """
 
-    now = datetime.datetime.now()
+    return time.strftime(_FILE_TIME_FORMAT, time.localtime())
+
+
+def load_json(file_name):
+    """!
+    \brief Loads a json file. Uses orjson, if available, as it is faster than the json module
+
+    \param file_name Path of the json file
+
+    \return The parsed content of the file
+    """
+
+    if orjson is None:
+        with open(file_name) as json_file:
+            return json.load(json_file)
 
-    return now.strftime('%Y-%m-%d_%H-%M-%S')
+    with open(file_name, 'rb') as json_file:
+        return orjson.loads(json_file.read())